@@ -0,0 +1,220 @@
+# Offline load test for the Dispatcher in bot/main.py.
+#
+#   python -m bench.dispatcher_bench [--users 500] [--concurrency 100]
+#                                    [--tg-latency-ms 30] [--db-latency-ms 20]
+#
+# Synthetic Message/CallbackQuery updates are fed straight into `dp`. The
+# Bot talks to a fake session that records every API call after a
+# configurable delay, and storage is the in-memory backend with an optional
+# per-call delay standing in for Firestore round trips. For each scenario it
+# prints throughput, p50/p95/p99 handler latency and storage/Telegram calls
+# per update.
+import argparse
+import asyncio
+import itertools
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from functools import wraps
+
+os.environ.update({
+    "STORAGE_BACKEND": "memory",
+    "BOT_TOKEN": "123456:BENCH",
+    "ADMIN_ID": "1",
+    "DEPOSIT_GROUP_ID": "-1001",
+    "WITHDRAW_GROUP_ID": "-1002",
+    "BANNER_IMAGE_URL": "https://example.com/banner.jpg",
+})
+os.environ.setdefault("BROADCAST_RATE", "100000")
+os.environ.setdefault("THROTTLE_GLOBAL_RATE", "100000")
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import CallbackQuery, Chat, Message, PhotoSize, Update, User
+from pydantic import TypeAdapter
+
+from bot import main as app
+from bot import broadcast, outbox, storage
+
+ADMIN_ID = 1
+_ids = itertools.count(1)
+
+class FakeSession(BaseSession):
+    # Records Bot API calls instead of sending them
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[method.__api_method__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        chat_id = getattr(method, "chat_id", None) or ADMIN_ID
+        msg = {
+            "message_id": next(_ids), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "text": getattr(method, "text", None),
+            "photo": [{"file_id": "BANNER_FILE_ID", "file_unique_id": "banner", "width": 1, "height": 1}],
+        }
+        returning = method.__returning__
+        if method.__api_method__ == "sendMediaGroup":
+            payload = [msg for _ in method.media]
+        elif method.__api_method__ == "copyMessage":
+            payload = {"message_id": msg["message_id"]}
+        elif returning is bool:
+            payload = True
+        else:
+            payload = msg
+        return TypeAdapter(returning).validate_python(payload, context={"bot": bot})
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+class StorageCounter:
+    # Wraps storage.run: counts calls and adds a fake round-trip delay
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = Counter()
+        self._run = storage.run
+
+    async def run(self, fn, *args, **kwargs):
+        self.calls[fn.__name__] += 1
+        if not self.latency:
+            return await self._run(fn, *args, **kwargs)
+
+        @wraps(fn)
+        def slow(*a, **kw):
+            time.sleep(self.latency)
+            return fn(*a, **kw)
+        return await self._run(slow, *args, **kwargs)
+
+# -- update builders --
+def _user(uid: int) -> User:
+    return User(id=uid, is_bot=False, first_name=f"User{uid}")
+
+def msg(uid: int, text: str = None, photo: bool = False) -> Update:
+    kw = {}
+    if photo:
+        kw["photo"] = [PhotoSize(file_id=f"shot{uid}", file_unique_id=f"u{uid}", width=1, height=1)]
+    m = Message(
+        message_id=next(_ids), date=datetime.now(), chat=Chat(id=uid, type="private"),
+        from_user=_user(uid), text=text, **kw,
+    )
+    return Update(update_id=next(_ids), message=m)
+
+def cb(uid: int, data: str) -> Update:
+    m = Message(message_id=next(_ids), date=datetime.now(), chat=Chat(id=uid, type="private"), text="x")
+    q = CallbackQuery(id=str(next(_ids)), from_user=_user(uid), chat_instance="bench", data=data, message=m)
+    return Update(update_id=next(_ids), callback_query=q)
+
+def pct(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+async def drain():
+    # wait for background work started by handlers (activity marks, broadcasts)
+    # and for the outbox sender to deliver everything queued
+    while True:
+        skip = (asyncio.current_task(), outbox._state["task"])
+        pending = [t for t in asyncio.all_tasks() if t not in skip]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        elif storage._db.outbox_backlog():
+            await asyncio.sleep(0.01)
+        else:
+            return
+
+async def scenario(name: str, flows, concurrency: int, tg: FakeSession, sc: StorageCounter) -> dict:
+    # flows run concurrently; updates inside one flow (one user's FSM) run in order
+    tg.calls.clear()
+    sc.calls.clear()
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run_flow(flow):
+        async with sem:
+            for upd in flow:
+                t = time.perf_counter()
+                await app.dp.feed_update(app.bot, upd)
+                latencies.append((time.perf_counter() - t) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_flow(f) for f in flows))
+    await drain()
+    secs = time.perf_counter() - start
+    n = len(latencies)
+    return {
+        "name": name, "updates": n, "secs": secs, "per_sec": n / secs,
+        "p50": pct(latencies, 0.50), "p95": pct(latencies, 0.95), "p99": pct(latencies, 0.99),
+        "db": sum(sc.calls.values()) / n, "tg": sum(tg.calls.values()) / n,
+    }
+
+async def run(args):
+    tg = FakeSession(args.tg_latency_ms / 1000)
+    app.create_bot(tg)
+    sc = StorageCounter(args.db_latency_ms / 1000)
+    storage.run = sc.run
+    outbox.start(app.bot)
+
+    users = list(range(1000, 1000 + args.users))
+    results = []
+
+    results.append(await scenario(
+        "start storm", [[msg(u, "/start")] for u in users], args.concurrency, tg, sc))
+    results.append(await scenario(
+        "wallet", [[msg(u, "💰 Wallet")] for u in users], args.concurrency, tg, sc))
+    results.append(await scenario(
+        "deposit flow",
+        [[msg(u, "➕ Deposit"), msg(u, "500"), msg(u, "📱 bKash"), msg(u, photo=True),
+          msg(u, "01700000000"), msg(u, f"TX{u}")] for u in users],
+        args.concurrency, tg, sc))
+
+    # everyone gets balance, then races for one product with limited stock
+    for u in users:
+        await storage.add_balance(u, 100.0)
+    pid = await app.catalog.create_product("Hot item", 10.0, args.users // 2, "CODE")
+    results.append(await scenario(
+        "concurrent buys", [[cb(u, f"buy:{pid}")] for u in users], args.concurrency, tg, sc))
+    left = (await storage.get_product(pid))["stock"]
+    assert left == 0, f"oversold/undersold: {left} left"
+
+    # a few users hammering Wallet/Products: coalesced while running, throttled
+    spam = ["💰 Wallet", "🛒 Products", "🧾 History"]
+    results.append(await scenario(
+        "flood", [[msg(u, spam[i % 3]) for i in range(30)] for u in users[:20]], args.concurrency, tg, sc))
+
+    results.append(await scenario(
+        "broadcast", [[msg(ADMIN_ID, "📢 Broadcast"), msg(ADMIN_ID, "Hello everyone")]], 1, tg, sc))
+    assert not broadcast._tasks
+
+    print(f"{'scenario':<16} {'updates':>7} {'secs':>7} {'upd/s':>8} {'p50ms':>7} {'p95ms':>7} {'p99ms':>7} {'db/upd':>7} {'tg/upd':>7}")
+    for r in results:
+        print(
+            f"{r['name']:<16} {r['updates']:>7} {r['secs']:>7.2f} {r['per_sec']:>8.1f} "
+            f"{r['p50']:>7.1f} {r['p95']:>7.1f} {r['p99']:>7.1f} {r['db']:>7.2f} {r['tg']:>7.2f}"
+        )
+    t = app.throttle.stats()
+    print(f"\nanti-flood: {t['throttled']} throttled, {t['coalesced']} coalesced")
+    if args.stats:
+        print("\n" + app.metrics.summary())
+    outbox.stop()
+    storage.shutdown()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=500)
+    ap.add_argument("--concurrency", type=int, default=100)
+    ap.add_argument("--tg-latency-ms", type=float, default=30)
+    ap.add_argument("--db-latency-ms", type=float, default=20)
+    ap.add_argument("--stats", action="store_true", help="print the admin 📈 Stats summary")
+    args = ap.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Per-operation cost of the FSM storage backends.
+#
+#   python -m bench.fsm_bench [--keys 2000] [--redis redis://localhost:6379/0]
+#
+# Replays the deposit flow's FSM traffic (set_state + update_data per step,
+# get_data at the end, then clear) for --keys users and reports µs per
+# storage call. Also checks that a SQLite-backed flow survives reopening
+# the file, i.e. a restart.
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from bot.fsm_storage import SQLiteStorage
+
+STEPS = ("amount", "method", "screenshot", "sender", "txid")
+
+def key(uid: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=uid, user_id=uid)
+
+async def flow(storage, uid: int) -> int:
+    k = key(uid)
+    for i, step in enumerate(STEPS):
+        await storage.set_state(k, f"Deposit:{step}")
+        await storage.update_data(k, {step: f"{step}-{uid}", "n": i})
+    await storage.get_state(k)
+    data = await storage.get_data(k)
+    assert data["txid"] == f"txid-{uid}", data
+    await storage.set_state(k, None)
+    await storage.set_data(k, {})
+    return len(STEPS) * 2 + 4
+
+async def bench(name: str, storage, keys: int):
+    start = time.perf_counter()
+    ops = 0
+    for uid in range(keys):
+        ops += await flow(storage, uid)
+    secs = time.perf_counter() - start
+    print(f"{name:<10} {ops:>8} ops {secs:>7.2f}s {secs / ops * 1e6:>8.1f} µs/op")
+    await storage.close()
+
+async def restart_check(path: str):
+    s = SQLiteStorage(path)
+    await s.set_state(key(42), "Deposit:txid")
+    await s.update_data(key(42), {"amount": 500})
+    await s.close()
+    s = SQLiteStorage(path)
+    assert await s.get_state(key(42)) == "Deposit:txid"
+    assert await s.get_data(key(42)) == {"amount": 500}
+    await s.close()
+    print("sqlite     state survives reopen: ok")
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "fsm.db")
+        await bench("memory", MemoryStorage(), args.keys)
+        await bench("sqlite", SQLiteStorage(path), args.keys)
+        await restart_check(path)
+    if args.redis:
+        from aiogram.fsm.storage.redis import RedisStorage
+        await bench("redis", RedisStorage.from_url(args.redis, state_ttl=3600, data_ttl=3600), args.keys)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--keys", type=int, default=2000)
+    ap.add_argument("--redis", help="also benchmark RedisStorage at this URL")
+    asyncio.run(run(ap.parse_args()))
+
+if __name__ == "__main__":
+    main()
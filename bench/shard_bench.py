@@ -0,0 +1,103 @@
+# Purchase throughput vs. stock shard count.
+#
+#   python -m bench.shard_bench [--buyers 400] [--threads 32] [--commit-ms 40] [--counter-shards 10]
+#
+# Runs on the local engine with a Firestore-like contention model: after a
+# simulated commit round trip a transaction retries if any document it read
+# has changed, or if another transaction committed a write to a document it
+# writes (blind Increments included) since it started. A single product doc
+# then sustains ~1000/commit-ms purchases/s, and spreading stock over N
+# shards should scale that roughly N-fold, as long as the aggregate
+# counters every purchase also writes (COUNTER_SHARDS) are spread as well.
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ["STORAGE_BACKEND"] = "memory"
+
+from bot import firebase_db as store
+from bot.local_db import CollectionReference, LocalClient, Transaction
+
+class ContendedClient(LocalClient):
+    def __init__(self, commit_ms: float):
+        super().__init__(":memory:")
+        self.commit_s = commit_ms / 1000
+        self.retries = 0
+        self.commits = 0
+        self.written = {}  # (path, id) -> commit number that last wrote it
+        self._tls = threading.local()
+
+    def _read(self, ref):
+        data = super()._read(ref)
+        reads = getattr(self._tls, "reads", None)
+        if reads is not None:
+            reads.setdefault((ref._path, ref.id), (ref, json.dumps(data)))
+        return data
+
+    def _query(self, sql: str, args):
+        rows = super()._query(sql, args)
+        reads = getattr(self._tls, "reads", None)
+        if reads is not None:
+            col = CollectionReference(self, args[0])
+            for doc_id, data in rows:
+                reads.setdefault((args[0], doc_id), (col.document(doc_id), json.dumps(json.loads(data))))
+        return rows
+
+    def run_transaction(self, fn):
+        while True:
+            started = self.commits
+            self._tls.reads = {}
+            try:
+                tx = Transaction(self)
+                result = fn(tx)
+                reads = self._tls.reads
+            finally:
+                self._tls.reads = None
+            time.sleep(self.commit_s)
+            keys = [(ref._path, ref.id) for _, ref, _ in tx._writes]
+            with self._lock:
+                if (all(self.written.get(k, 0) <= started for k in keys)
+                        and all(json.dumps(super(ContendedClient, self)._read(ref)) == seen for ref, seen in reads.values())):
+                    self._apply(tx._writes)
+                    self.commits += 1
+                    for k in keys:
+                        self.written[k] = self.commits
+                    return result
+                self.retries += 1
+
+def run(shards: int, buyers: int, threads: int, commit_ms: float) -> dict:
+    store.db = client = ContendedClient(commit_ms)
+    pid = store.create_product("Hot item", 1.0, buyers, "CODE", shards=shards)
+    for uid in range(buyers):
+        store.get_user_doc(uid).set({"tg_id": uid, "balance": 10.0})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as ex:
+        results = list(ex.map(lambda uid: store.purchase(uid, pid)["status"], range(buyers)))
+    elapsed = time.perf_counter() - start
+
+    ok = results.count("ok")
+    left = store.sharded_stock(pid) if shards > 1 else store.get_product(pid)["stock"]
+    assert ok + left == buyers, "stock mismatch"
+    return {"shards": shards, "ok": ok, "secs": elapsed, "per_sec": ok / elapsed, "retries": client.retries}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--buyers", type=int, default=400)
+    ap.add_argument("--threads", type=int, default=32)
+    ap.add_argument("--commit-ms", type=float, default=40)
+    ap.add_argument("--shards", default="1,2,4,8,16")
+    ap.add_argument("--counter-shards", type=int, default=store.COUNTER_SHARDS)
+    args = ap.parse_args()
+    store.COUNTER_SHARDS = args.counter_shards
+
+    print(f"{'shards':>6} {'ok':>6} {'secs':>7} {'buys/s':>8} {'retries':>8}")
+    for n in (int(x) for x in args.shards.split(",")):
+        r = run(n, args.buyers, args.threads, args.commit_ms)
+        print(f"{r['shards']:>6} {r['ok']:>6} {r['secs']:>7.2f} {r['per_sec']:>8.1f} {r['retries']:>8}")
+
+if __name__ == "__main__":
+    main()
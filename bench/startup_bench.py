@@ -0,0 +1,83 @@
+# Startup time: how long a restart takes until the bot can serve.
+#
+#   python -m bench.startup_bench [--products 200] [--users 5000] [--budget-ms 500]
+#
+# 1. imports bot.main in a fresh interpreter with STORAGE_BACKEND=firestore,
+#    no credentials and no BOT_TOKEN: must succeed (nothing connects at import)
+# 2. against a seeded SQLite file, times the startup hook (ready to take
+#    updates), the background warm-up, and the first "🛒 Products" update.
+# Exits non-zero if the startup hook takes longer than --budget-ms.
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+IMPORT_CHECK = (
+    "import time; t = time.perf_counter(); import bot.main; "
+    "print((time.perf_counter() - t) * 1000)"
+)
+
+def import_ms() -> float:
+    env = {**os.environ, "STORAGE_BACKEND": "firestore", "BOT_TOKEN": "",
+           "FIREBASE_SERVICE_ACCOUNT": "/nonexistent.json", "FSM_STORAGE": "memory"}
+    out = subprocess.run([sys.executable, "-c", IMPORT_CHECK], env=env, capture_output=True, text=True)
+    if out.returncode:
+        sys.exit(f"import bot.main failed without credentials:\n{out.stderr}")
+    return float(out.stdout.strip())
+
+def seed(products: int, users: int):
+    from bot import firebase_db as store
+    store.init()
+    for i in range(products):
+        store.create_product(f"Item {i}", 10.0 + i, 100, "CODE", shards=4 if i % 10 == 0 else 1)
+    batch = store.client().batch()
+    for uid in range(1, users + 1):
+        batch.set(store.get_user_doc(uid), {"tg_id": uid, "name": f"U{uid}", "balance": 0.0})
+    batch.commit()
+    store.rebuild_user_count()
+
+async def serve(args) -> dict:
+    from bench.dispatcher_bench import FakeSession, msg
+    from bot import main as app
+
+    bot = app.create_bot(FakeSession(args.tg_latency_ms / 1000))
+    t0 = time.perf_counter()
+    await app.on_startup(bot)
+    ready = time.perf_counter()
+    await app.dp.feed_update(bot, msg(1000, "🛒 Products"))
+    first = time.perf_counter()
+    await app._warm["task"]
+    warm = time.perf_counter()
+    await app.on_shutdown(bot)
+    return {"ready": (ready - t0) * 1000, "first": (first - ready) * 1000, "warm": (warm - t0) * 1000}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--products", type=int, default=200)
+    ap.add_argument("--users", type=int, default=5000)
+    ap.add_argument("--tg-latency-ms", type=float, default=30)
+    ap.add_argument("--budget-ms", type=float, default=500)
+    args = ap.parse_args()
+
+    print(f"import bot.main (no credentials): {import_ms():8.1f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "STORAGE_BACKEND": "sqlite", "SQLITE_PATH": os.path.join(tmp, "startup.db"),
+            "BOT_TOKEN": "123456:BENCH", "METRICS_PORT": "0",
+            "BANNER_IMAGE_URL": "https://example.com/banner.jpg",
+        })
+        seed(args.products, args.users)
+        r = asyncio.run(serve(args))
+    print(f"startup hook (ready to serve):    {r['ready']:8.1f} ms")
+    print(f"first update after ready:         {r['first']:8.1f} ms")
+    print(f"warm-up done:                     {r['warm']:8.1f} ms")
+    if r["ready"] > args.budget_ms:
+        sys.exit(f"startup hook over budget: {r['ready']:.1f} ms > {args.budget_ms:.0f} ms")
+    print(f"within budget ({args.budget_ms:.0f} ms)")
+
+if __name__ == "__main__":
+    main()
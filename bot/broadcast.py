@@ -0,0 +1,115 @@
+# Broadcast engine: pages through users, sends concurrently under Telegram's
+# rate limits and checkpoints progress per page so a restart resumes the job.
+import asyncio
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+from .config import (
+    BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_PAGE_SIZE, BROADCAST_REPORT_SEC,
+)
+from .ratelimit import ChatLimiter
+from . import storage as db
+
+MAX_RETRIES = 5
+
+# ~30 msg/s globally, 1 msg/s per chat
+limiter = ChatLimiter(BROADCAST_RATE, 1.0)
+
+_tasks = {}
+
+def progress_text(job: dict, done: bool = False) -> str:
+    head = "✅ Broadcast done" if done else "📢 Broadcasting..."
+    return (
+        f"{head}\n\n"
+        f"📨 Sent: {job.get('sent', 0)}\n"
+        f"❌ Failed: {job.get('failed', 0)}\n"
+        f"🚫 Blocked: {job.get('blocked', 0)}"
+    )
+
+async def start(bot: Bot, admin_id: int, from_chat_id: int, message_id: int) -> str:
+    status = await bot.send_message(admin_id, progress_text({}))
+    job = {
+        "status": "running",
+        "admin_id": admin_id,
+        "from_chat_id": from_chat_id,
+        "message_id": message_id,
+        "progress_msg_id": status.message_id,
+        "cursor": None,
+        "sent": 0, "failed": 0, "blocked": 0,
+        "created_at": db.now_iso(),
+    }
+    job["job_id"] = await db.create_broadcast(job)
+    launch(bot, job)
+    return job["job_id"]
+
+def launch(bot: Bot, job: dict):
+    job_id = job["job_id"]
+    task = asyncio.create_task(_run(bot, job))
+    _tasks[job_id] = task
+    task.add_done_callback(lambda _: _tasks.pop(job_id, None))
+
+async def resume_all(bot: Bot):
+    for job in await db.running_broadcasts():
+        if job["job_id"] not in _tasks:
+            launch(bot, job)
+
+async def _report(bot: Bot, job: dict, done: bool = False):
+    try:
+        await limiter.wait(job["admin_id"])
+        await bot.edit_message_text(
+            progress_text(job, done), chat_id=job["admin_id"], message_id=job["progress_msg_id"]
+        )
+    except Exception:
+        pass
+
+async def _reporter(bot: Bot, job: dict):
+    # live progress every BROADCAST_REPORT_SEC, independent of page size
+    last = None
+    while True:
+        await asyncio.sleep(BROADCAST_REPORT_SEC)
+        counts = (job["sent"], job["failed"], job["blocked"])
+        if counts != last:
+            last = counts
+            await _report(bot, job)
+
+async def _send(bot: Bot, job: dict, uid: int) -> str:
+    for _ in range(MAX_RETRIES):
+        await limiter.wait(uid)
+        try:
+            await bot.copy_message(uid, job["from_chat_id"], job["message_id"])
+            return "sent"
+        except TelegramRetryAfter as e:
+            limiter.pause(e.retry_after)
+        except TelegramForbiddenError:
+            return "blocked"
+        except Exception:
+            return "failed"
+    return "failed"
+
+async def _run(bot: Bot, job: dict):
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    reporter = asyncio.create_task(_reporter(bot, job))
+    try:
+        await _send_all(bot, job, sem)
+    finally:
+        reporter.cancel()
+    await db.update_broadcast(job["job_id"], {"status": "done", "finished_at": db.now_iso()})
+    await _report(bot, job, done=True)
+
+async def _send_all(bot: Bot, job: dict, sem: asyncio.Semaphore):
+    async def one(uid: int):
+        async with sem:
+            result = await _send(bot, job, uid)
+        job[result] += 1
+
+    page = await db.user_ids_page(job.get("cursor"), BROADCAST_PAGE_SIZE)
+    while page:
+        # fetch the next page while this one is being sent
+        next_page = asyncio.create_task(db.user_ids_page(page[-1], BROADCAST_PAGE_SIZE))
+        await asyncio.gather(*(one(uid) for uid in page))
+        job["cursor"] = page[-1]
+        await db.update_broadcast(job["job_id"], {
+            "cursor": job["cursor"], "sent": job["sent"], "failed": job["failed"], "blocked": job["blocked"],
+        })
+        page = await next_page
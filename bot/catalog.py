@@ -0,0 +1,180 @@
+# In-process product catalog. Loaded once, then kept current by a Firestore
+# snapshot listener; local backends fall back to a TTL. Writes made through
+# this module invalidate it, so browsing the shop costs no database reads.
+# Sharded products show the summed shard stock and code-pool products the
+# number of unused codes, both cached for STOCK_TTL_SEC.
+#
+# The shop is browsed by category in pages of SHOP_PAGE_SIZE. The layout
+# (categories, pages of product ids) is computed once per catalog change.
+import asyncio
+import time
+
+from .config import CATALOG_TTL_SEC, STOCK_TTL_SEC, SHOP_PAGE_SIZE
+from . import firebase_db as _db
+from . import storage as db
+
+DEFAULT_CATEGORY = "Other"
+
+_state = {"items": {}, "loaded_at": None, "live": False, "watch": None, "layout": None}
+_totals = {}  # pid -> (summed shard stock, monotonic time)
+_load_lock = asyncio.Lock()  # one reload at a time; waiters reuse its result
+
+def _sharded(p: dict) -> bool:
+    # stock not kept on the product doc itself
+    return bool(p.get("pool")) or int(p.get("shards") or 1) > 1
+
+def _view(pid: str, p: dict) -> dict:
+    if _sharded(p) and pid in _totals:
+        return {**p, "stock": _totals[pid][0]}
+    return p
+
+def _count(pid: str):
+    p = _state["items"].get(pid) or {}
+    return db.pool_stock(pid) if p.get("pool") else db.sharded_stock(pid)
+
+async def _refresh_totals(pids):
+    now = time.monotonic()
+    stale = [pid for pid in pids if pid not in _totals or now - _totals[pid][1] >= STOCK_TTL_SEC]
+    if not stale:
+        return
+    totals = await asyncio.gather(*(_count(pid) for pid in stale))
+    now = time.monotonic()
+    changed = False
+    for pid, total in zip(stale, totals):
+        changed = changed or pid not in _totals or _totals[pid][0] != total
+        _totals[pid] = (total, now)
+    if changed:
+        _changed()
+
+def _changed():
+    # drop the shop layout; rebuilt on the next page view
+    _state["layout"] = None
+
+def _replace(items):
+    _state["items"] = dict(items)
+    _state["loaded_at"] = time.monotonic()
+    _changed()
+
+def _on_snapshot(items):
+    # runs on the listener's thread; swapping the dict is atomic
+    _replace(items)
+    _state["live"] = True
+
+async def start():
+    _state["watch"] = await db.run(_db.watch_products, _on_snapshot)
+    await ensure_loaded()
+
+def stop():
+    if _state["watch"] is not None:
+        _state["watch"].unsubscribe()
+        _state["watch"] = None
+    _state["live"] = False
+
+def invalidate():
+    _state["loaded_at"] = None
+
+def on_purchase(pid: str, res: dict):
+    # keep cached stock in step with a purchase result
+    if pid in _totals:
+        total, at = _totals[pid]
+        if res["status"] == "ok":
+            total = max(0, total - 1)
+        elif res["status"] == "out_of_stock":
+            total = 0
+        if total != _totals[pid][0]:
+            _totals[pid] = (total, at)
+            _changed()
+    elif "stock" in res:
+        patch(pid, {"stock": res["stock"]})
+
+def patch(pid: str, data: dict):
+    # apply a known write (e.g. stock after a purchase) without a reload
+    p = _state["items"].get(pid)
+    if p is not None:
+        _state["items"][pid] = {**p, **data}
+        _changed()
+
+async def ensure_loaded():
+    if _state["live"]:
+        return
+    async with _load_lock:
+        loaded_at = _state["loaded_at"]
+        if loaded_at is not None and time.monotonic() - loaded_at < CATALOG_TTL_SEC:
+            return
+        _replace(await db.list_products())
+
+async def list_products():
+    await ensure_loaded()
+    items = list(_state["items"].items())
+    await _refresh_totals([pid for pid, p in items if _sharded(p)])
+    return [(pid, _view(pid, p)) for pid, p in items]
+
+def _layout():
+    # [(category, [[pid, ...] per page])], categories and names alphabetical
+    layout = _state["layout"]
+    if layout is None:
+        by_cat = {}
+        for pid, p in sorted(_state["items"].items(), key=lambda kv: str(kv[1].get("name") or "").lower()):
+            by_cat.setdefault(p.get("category") or DEFAULT_CATEGORY, []).append(pid)
+        layout = [
+            (cat, [pids[i:i + SHOP_PAGE_SIZE] for i in range(0, len(pids), SHOP_PAGE_SIZE)])
+            for cat, pids in sorted(by_cat.items(), key=lambda kv: kv[0].lower())
+        ]
+        _state["layout"] = layout
+    return layout
+
+async def categories():
+    # [(category, product count)]
+    await ensure_loaded()
+    return [(cat, sum(len(page) for page in pages)) for cat, pages in _layout()]
+
+async def shop_page(cat: int, page: int):
+    # one page of a category; indexes are clamped, since the catalog may have
+    # changed since the keyboard was sent
+    await ensure_loaded()
+    layout = _layout()
+    if not layout:
+        return None
+    cat = min(max(cat, 0), len(layout) - 1)
+    name, pages = layout[cat]
+    page = min(max(page, 0), len(pages) - 1)
+    pids = [pid for pid in pages[page] if pid in _state["items"]]
+    await _refresh_totals([pid for pid in pids if _sharded(_state["items"][pid])])
+    return {
+        "category": name, "cat": cat, "page": page, "pages": len(pages), "categories": len(layout),
+        "items": [(pid, _view(pid, _state["items"][pid])) for pid in pids if pid in _state["items"]],
+    }
+
+async def get_product(pid: str):
+    await ensure_loaded()
+    p = _state["items"].get(pid)
+    if p is None:
+        return None
+    if _sharded(p):
+        await _refresh_totals([pid])
+    return _view(pid, p)
+
+async def create_product(name: str, price: float, stock: int, delivery: str, pool: bool = False, category: str = "") -> str:
+    pid = await db.create_product(name, price, stock, delivery, pool=pool, category=category)
+    invalidate()
+    return pid
+
+async def add_codes(pid: str, items: list) -> dict:
+    res = await db.add_codes(pid, items)
+    _totals.pop(pid, None)
+    return res
+
+async def update_product(pid: str, data: dict):
+    await db.update_product(pid, data)
+    invalidate()
+
+async def delete_product(pid: str):
+    await db.delete_product(pid)
+    _totals.pop(pid, None)
+    invalidate()
+
+async def reshard_product(pid: str, shards: int):
+    ok = await db.reshard_product(pid, shards)
+    _totals.pop(pid, None)
+    invalidate()
+    return ok
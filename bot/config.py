@@ -23,3 +23,85 @@ USD_RATE_BDT = float(os.getenv("USD_RATE_BDT", "115"))
 FIREBASE_SERVICE_ACCOUNT = os.getenv("FIREBASE_SERVICE_ACCOUNT", "serviceAccountKey.json")
 
 SUPPORT_USERNAME = os.getenv("SUPPORT_USERNAME", "@developer_x_asik_prof")
+
+# Storage: firestore | sqlite | memory
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "dxashop.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+
+# Broadcast (Telegram allows ~30 msg/s overall, 1 msg/s per chat)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))
+BROADCAST_REPORT_SEC = float(os.getenv("BROADCAST_REPORT_SEC", "3"))
+
+# Product catalog cache (used when no live listener is available)
+CATALOG_TTL_SEC = float(os.getenv("CATALOG_TTL_SEC", "60"))
+
+# Sharded stock: default shard count for new products (1 = off);
+# /shards <product_id> <n> sets it per hot product
+STOCK_SHARDS = int(os.getenv("STOCK_SHARDS", "1"))
+STOCK_TTL_SEC = float(os.getenv("STOCK_TTL_SEC", "10"))
+CODE_BATCH_SIZE = int(os.getenv("CODE_BATCH_SIZE", "400"))  # code pool writes per batch (Firestore max 500)
+
+# Shards per hot counter doc (user counts); only ever raise it
+COUNTER_SHARDS = int(os.getenv("COUNTER_SHARDS", "10"))
+
+# In-process caches (entries)
+KNOWN_USERS_CACHE = int(os.getenv("KNOWN_USERS_CACHE", "50000"))
+BALANCE_CACHE = int(os.getenv("BALANCE_CACHE", "50000"))
+GROUP_POST_CACHE = int(os.getenv("GROUP_POST_CACHE", "5000"))
+BALANCE_TTL_SEC = float(os.getenv("BALANCE_TTL_SEC", "30"))
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "5"))
+SHOP_PAGE_SIZE = int(os.getenv("SHOP_PAGE_SIZE", "8"))  # products per shop page
+
+# Admin pending queue: requests per page, requests per bulk transaction
+PENDING_PAGE_SIZE = int(os.getenv("PENDING_PAGE_SIZE", "8"))
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "100"))
+
+# Prometheus-text /metrics endpoint (port 0 = off)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Runner: polling | webhook
+RUN_MODE = os.getenv("RUN_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # public base, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_LISTEN_HOST = os.getenv("WEBHOOK_LISTEN_HOST", "0.0.0.0")
+WEBHOOK_LISTEN_PORT = int(os.getenv("WEBHOOK_LISTEN_PORT", "8080"))
+# >1: the listener routes each user's updates to one of N worker processes
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+WEBHOOK_WORKER_PORT = int(os.getenv("WEBHOOK_WORKER_PORT", "8100"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+
+# Each worker has its own in-process caches. A balance written on one
+# worker (an approval is routed by the admin's id) would stay stale on the
+# user's worker for BALANCE_TTL_SEC, so the balance cache is off there.
+MULTI_WORKER = RUN_MODE == "webhook" and WEBHOOK_WORKERS > 1
+if MULTI_WORKER:
+    BALANCE_CACHE = 0
+
+# FSM storage: memory | sqlite | redis
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory").lower()
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", "fsm.db")
+FSM_REDIS_URL = os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0")
+FSM_TTL_SEC = float(os.getenv("FSM_TTL_SEC", "86400"))  # abandoned flows expire
+
+# Notification outbox sender
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "10"))
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "50"))
+OUTBOX_POLL_SEC = float(os.getenv("OUTBOX_POLL_SEC", "5"))
+OUTBOX_LEASE_SEC = float(os.getenv("OUTBOX_LEASE_SEC", "60"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_KEEP_FAILED_DAYS = float(os.getenv("OUTBOX_KEEP_FAILED_DAYS", "7"))  # sent ones are deleted at once
+
+# Approve/reject taps: how long handled callbacks/requests are remembered
+CALLBACK_DEDUP_TTL_SEC = float(os.getenv("CALLBACK_DEDUP_TTL_SEC", "120"))
+
+# Anti-flood (admins and approve/reject callbacks are exempt)
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))  # per user, requests/second
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "8"))
+THROTTLE_GLOBAL_RATE = float(os.getenv("THROTTLE_GLOBAL_RATE", "200"))
+THROTTLE_IDLE_SEC = float(os.getenv("THROTTLE_IDLE_SEC", "300"))
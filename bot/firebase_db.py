@@ -0,0 +1,907 @@
+import hashlib
+import random
+import re
+import threading
+from datetime import datetime, timedelta
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.api_core.exceptions import AlreadyExists
+
+from .config import (
+    FIREBASE_SERVICE_ACCOUNT, STORAGE_BACKEND, SQLITE_PATH, STOCK_SHARDS,
+    KNOWN_USERS_CACHE, BALANCE_CACHE, BALANCE_TTL_SEC, BULK_CHUNK_SIZE, GROUP_POST_CACHE,
+    CODE_BATCH_SIZE, COUNTER_SHARDS, OUTBOX_KEEP_FAILED_DAYS,
+)
+from .cache import LRUCache
+
+# Backends: "firestore" (default), "sqlite" (local WAL file) or "memory".
+# The local engine speaks the same client API, so the functions below are
+# shared by every backend.
+def connect(backend: str = STORAGE_BACKEND):
+    if backend == "firestore":
+        cred = credentials.Certificate(FIREBASE_SERVICE_ACCOUNT)
+        firebase_admin.initialize_app(cred)
+        return firestore.client()
+    if backend in ("sqlite", "memory"):
+        from .local_db import LocalClient
+        return LocalClient(SQLITE_PATH if backend == "sqlite" else ":memory:")
+    raise RuntimeError(f"Unknown STORAGE_BACKEND: {backend}")
+
+# The client is created on first use (or by init() at startup), so
+# importing this module needs no credentials and does no SDK setup.
+db = None
+_init_lock = threading.Lock()
+
+def init(backend: str = STORAGE_BACKEND):
+    global db
+    with _init_lock:
+        if db is None:
+            db = connect(backend)
+    return db
+
+def client():
+    return db if db is not None else init()
+
+def now_iso() -> str:
+    return datetime.utcnow().isoformat()
+
+def today() -> str:
+    return datetime.utcnow().date().isoformat()
+
+def run_transaction(fn):
+    # fn(tx) runs inside a transaction (retried on contention by Firestore)
+    c = client()
+    if not isinstance(c, firestore.Client):
+        return c.run_transaction(fn)
+
+    @firestore.transactional
+    def _run(tx):
+        return fn(tx)
+    return _run(c.transaction())
+
+# Collections
+def users():
+    return client().collection("users")
+
+def deposits():
+    return client().collection("deposits")
+
+def withdraws():
+    return client().collection("withdraws")
+
+def products():
+    return client().collection("products")
+
+def broadcasts():
+    return client().collection("broadcasts")
+
+def stock_shards(pid: str):
+    return products().document(pid).collection("stock_shards")
+
+def codes(pid: str):
+    return products().document(pid).collection("codes")
+
+def orders():
+    return client().collection("orders")
+
+def ledger():
+    return client().collection("ledger")
+
+def stats():
+    return client().collection("stats")
+
+def stats_daily():
+    return client().collection("stats_daily")
+
+def settings():
+    return client().collection("settings")
+
+def outbox():
+    return client().collection("outbox")
+
+def deposit_txids():
+    return client().collection("deposit_txids")
+
+def deposit_photos():
+    return client().collection("deposit_photos")
+
+def group_posts():
+    return client().collection("group_posts")
+
+def finance():
+    return client().collection("finance")
+
+# Settings (small key -> dict values)
+def get_setting(key: str):
+    snap = settings().document(key).get()
+    if not snap.exists:
+        return None
+    return snap.to_dict()
+
+def set_setting(key: str, value: dict):
+    settings().document(key).set(value)
+
+# Sharded counters: a counter doc every registration / sale would write is
+# spread over COUNTER_SHARDS docs "{name}_{i}". Writers Increment a random
+# shard; readers sum "{name}" itself plus every shard in one get_all. Only
+# ever raise COUNTER_SHARDS: shards above it would no longer be read.
+def _counter_shard(coll, name: str):
+    return coll.document(f"{name}_{random.randrange(COUNTER_SHARDS)}")
+
+def _counter_refs(coll, name: str) -> list:
+    return [coll.document(name)] + [coll.document(f"{name}_{i}") for i in range(COUNTER_SHARDS)]
+
+def _add(acc: dict, values: dict):
+    for k, v in values.items():
+        if isinstance(v, dict):
+            _add(acc.setdefault(k, {}), v)
+        elif isinstance(v, (str, bool)):
+            acc[k] = v
+        else:
+            acc[k] = acc.get(k, 0) + v
+
+def _sum_counters(snaps) -> dict:
+    out = {}
+    for s in snaps:
+        if s is not None and s.exists:
+            _add(out, s.to_dict())
+    return out
+
+# Users
+_UNKNOWN = object()
+
+# tg_id -> last known display name
+known_users = LRUCache(KNOWN_USERS_CACHE)
+# tg_id -> balance, written through by every balance change
+balances = LRUCache(BALANCE_CACHE, ttl=BALANCE_TTL_SEC)
+
+def get_user_doc(tg_id: int):
+    return users().document(str(tg_id))
+
+def ensure_user(tg_id: int, name: str) -> bool:
+    # Returns True if the user was created. Known users (LRU) with an
+    # unchanged name cost nothing; new users cost a single create write.
+    known = known_users.get(tg_id, _UNKNOWN)
+    if known == name:
+        return False
+    doc = get_user_doc(tg_id)
+    if known is not _UNKNOWN:
+        doc.update({"name": name})
+        known_users.set(tg_id, name)
+        return False
+
+    # user doc + counters in one atomic batch; create() fails if the user
+    # already exists, so counters never double count
+    day = today()
+    batch = client().batch()
+    batch.create(doc, {
+        "tg_id": tg_id, "name": name, "balance": 0.0, "created_at": now_iso(), "last_active_day": day,
+    })
+    batch.set(_counter_shard(stats(), "users"), {"total": firestore.Increment(1)}, merge=True)
+    batch.set(_counter_shard(stats_daily(), day), {"new_users": firestore.Increment(1), "active_users": firestore.Increment(1)}, merge=True)
+    try:
+        batch.commit()
+        created = True
+    except AlreadyExists:
+        created = False
+        snap = doc.get()
+        if (snap.to_dict() or {}).get("name") != name:
+            doc.update({"name": name})
+    known_users.set(tg_id, name)
+    return created
+
+def touch_user(tg_id: int) -> bool:
+    # count the user as active today (once per day)
+    doc = get_user_doc(tg_id)
+    day = today()
+
+    def txn(tx):
+        snap = doc.get(transaction=tx)
+        if not snap.exists or snap.to_dict().get("last_active_day") == day:
+            return False
+        tx.update(doc, {"last_active_day": day})
+        tx.set(_counter_shard(stats_daily(), day), {"active_users": firestore.Increment(1)}, merge=True)
+        return True
+
+    return run_transaction(txn)
+
+def get_balance(tg_id: int) -> float:
+    # Display/pre-check only: authoritative checks happen inside transactions
+    bal = balances.get(tg_id)
+    if bal is not None:
+        return bal
+    snap = get_user_doc(tg_id).get()
+    if not snap.exists:
+        return 0.0
+    bal = float(snap.to_dict().get("balance", 0.0))
+    balances.set(tg_id, bal)
+    return bal
+
+# Every balance change appends a ledger entry in the same transaction.
+# kind: deposit | withdraw | purchase | admin
+def _ledger_entry(tx, tg_id: int, kind: str, amount: float, balance: float, ref: str = None, note: str = None):
+    doc = ledger().document()
+    tx.set(doc, {
+        "entry_id": doc.id, "tg_id": tg_id, "kind": kind, "amount": amount,
+        "balance": balance, "ref": ref, "note": note, "created_at": now_iso(),
+    })
+
+def add_balance(tg_id: int, amount: float, kind: str = "admin", ref: str = None, note: str = None):
+    doc = get_user_doc(tg_id)
+
+    def txn(tx):
+        snap = doc.get(transaction=tx)
+        bal = float(snap.to_dict().get("balance", 0.0)) if snap.exists else 0.0
+        tx.set(doc, {"balance": bal + amount}, merge=True)
+        _ledger_entry(tx, tg_id, kind, amount, bal + amount, ref, note)
+        _finance(tx, state={"balances": amount})
+        return bal + amount
+
+    balances.set(tg_id, run_transaction(txn))
+
+def deduct_balance(tg_id: int, amount: float, kind: str = "admin", ref: str = None, note: str = None) -> bool:
+    doc = get_user_doc(tg_id)
+
+    def txn(tx):
+        snap = doc.get(transaction=tx)
+        if not snap.exists:
+            return None
+        bal = float(snap.to_dict().get("balance", 0.0))
+        if bal < amount:
+            balances.set(tg_id, bal)
+            return None
+        tx.update(doc, {"balance": bal - amount})
+        _ledger_entry(tx, tg_id, kind, -amount, bal - amount, ref, note)
+        _finance(tx, state={"balances": -amount})
+        return bal - amount
+
+    bal = run_transaction(txn)
+    if bal is None:
+        return False
+    balances.set(tg_id, bal)
+    return True
+
+def cache_stats() -> dict:
+    return {"known_users": known_users.stats(), "balances": balances.stats(), "group_posts": group_post_cache.stats()}
+
+def user_ids_page(after: int = None, limit: int = 500) -> list:
+    q = users().order_by("tg_id")
+    if after is not None:
+        q = q.start_after({"tg_id": after})
+    return [int(s.get("tg_id")) for s in q.limit(limit).stream()]
+
+# Deposits / Withdraws
+# Uniqueness indexes: one doc per (method, TxID) and per screenshot
+# file_unique_id, owned by the first deposit that used it. Creating a
+# deposit reads both with one get_all, so reuse is flagged in O(1) however
+# many deposits exist. Returns the stored deposit incl. dup_txid/dup_photo
+# (the earlier request id, or None).
+def txid_key(method: str, txid: str) -> str:
+    norm = re.sub(r"\s+", "", txid or "").upper()
+    return hashlib.sha1(f"{method}:{norm}".encode()).hexdigest()
+
+def create_deposit(data: dict) -> dict:
+    doc = deposits().document()
+    tref = deposit_txids().document(txid_key(data.get("method"), data.get("txid")))
+    pref = deposit_photos().document(data["photo_unique_id"]) if data.get("photo_unique_id") else None
+
+    def txn(tx):
+        refs = [tref] + ([pref] if pref else [])
+        seen = {s.id: s.to_dict().get("req_id") for s in client().get_all(refs, transaction=tx) if s.exists}
+        dep = {
+            "req_id": doc.id, **data,
+            "dup_txid": seen.get(tref.id),
+            "dup_photo": seen.get(pref.id) if pref else None,
+        }
+        tx.set(doc, dep)
+        if tref.id not in seen:
+            tx.set(tref, {"req_id": doc.id, "method": data.get("method"), "txid": data.get("txid")})
+        if pref and pref.id not in seen:
+            tx.set(pref, {"req_id": doc.id})
+        _finance(tx, state={"deposits_pending": 1, "deposits_pending_amount": float(data.get("amount", 0))})
+        return dep
+
+    return run_transaction(txn)
+
+def get_deposit(req_id: str):
+    snap = deposits().document(req_id).get()
+    if not snap.exists:
+        return None
+    return snap.to_dict()
+
+def update_deposit(req_id: str, data: dict):
+    deposits().document(req_id).update(data)
+
+def create_withdraw(data: dict) -> str:
+    doc = withdraws().document()
+    batch = client().batch()
+    batch.set(doc, {"req_id": doc.id, **data})
+    _finance(batch, state={"withdraws_pending": 1, "withdraws_pending_amount": float(data.get("amount", 0))})
+    batch.commit()
+    return doc.id
+
+def get_withdraw(req_id: str):
+    snap = withdraws().document(req_id).get()
+    if not snap.exists:
+        return None
+    return snap.to_dict()
+
+def update_withdraw(req_id: str, data: dict):
+    withdraws().document(req_id).update(data)
+
+def requests(kind: str):
+    # kind: dep | wd
+    return deposits() if kind == "dep" else withdraws()
+
+# Pending queue, oldest first: one indexed query per page (status ==,
+# created_at asc). cursor is the created_at of the edge request shown.
+def pending_page(kind: str, cursor: str = None, direction: str = "next", limit: int = 8):
+    order = firestore.Query.ASCENDING if direction == "next" else firestore.Query.DESCENDING
+    q = requests(kind).where("status", "==", "pending").order_by("created_at", direction=order)
+    if cursor:
+        q = q.start_after({"created_at": cursor})
+    rows = [s.to_dict() for s in q.limit(limit + 1).stream()]
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if direction != "next":
+        rows.reverse()
+    return rows, more
+
+# Bulk approve/reject. Each chunk of BULK_CHUNK_SIZE requests is one
+# transaction: requests and their users come from two get_all reads, balances
+# are applied in order per user (two withdraws can't both spend the same
+# balance), and a withdraw the user can't cover is rejected on its own
+# without failing the rest of the chunk. Returns each request with
+# "result": approved | rejected | skipped (not pending) | not_found.
+# notify(kind, request) -> text queues the user's notification in the same
+# transaction (see outbox below).
+def decide_requests(kind: str, req_ids: list, approve: bool, notify=None) -> list:
+    req_ids = list(dict.fromkeys(req_ids))
+    results = []
+    for i in range(0, len(req_ids), BULK_CHUNK_SIZE):
+        results.extend(_decide_chunk(kind, req_ids[i:i + BULK_CHUNK_SIZE], approve, notify))
+    return results
+
+def _decide_chunk(kind: str, req_ids: list, approve: bool, notify=None) -> list:
+    refs = [requests(kind).document(r) for r in req_ids]
+
+    def txn(tx):
+        snaps = {s.id: s for s in client().get_all(refs, transaction=tx)}
+        reqs = {r: snaps[r].to_dict() for r in req_ids if r in snaps and snaps[r].exists}
+        bals = {}
+        if approve:
+            uids = {int(d["tg_id"]) for d in reqs.values() if d.get("status") == "pending"}
+            for s in client().get_all([get_user_doc(u) for u in uids], transaction=tx):
+                bals[int(s.id)] = float(s.to_dict().get("balance", 0.0)) if s.exists else None
+
+        out, changed, flows, state = [], {}, {}, {}
+        name = "deposits" if kind == "dep" else "withdraws"
+        for ref in refs:
+            d = reqs.get(ref.id)
+            if d is None:
+                out.append({"req_id": ref.id, "result": "not_found"})
+                continue
+            if d.get("status") != "pending":
+                out.append({**d, "result": "skipped"})
+                continue
+            uid, amount = int(d["tg_id"]), float(d["amount"])
+            _add(state, {f"{name}_pending": -1, f"{name}_pending_amount": -amount})
+            if not approve:
+                tx.update(ref, {"status": "rejected", "rejected_at": now_iso()})
+                out.append({**d, "result": "rejected"})
+                _add(flows, {f"{name}_rejected": 1})
+                continue
+            bal = bals.get(uid)
+            if kind == "wd" and (bal is None or bal < amount):
+                tx.update(ref, {"status": "rejected", "rejected_at": now_iso(), "reason": "insufficient_balance"})
+                out.append({**d, "result": "rejected", "reason": "insufficient_balance"})
+                _add(flows, {f"{name}_rejected": 1})
+                continue
+            delta = amount if kind == "dep" else -amount
+            bal = (bal or 0.0) + delta
+            bals[uid] = changed[uid] = bal
+            _ledger_entry(tx, uid, "deposit" if kind == "dep" else "withdraw", delta, bal, ref.id)
+            tx.update(ref, {"status": "approved", "approved_at": now_iso()})
+            out.append({**d, "result": "approved"})
+            _add(flows, _approved_flows(kind, d))
+            _add(state, {"balances": delta})
+        for uid, bal in changed.items():
+            tx.set(get_user_doc(uid), {"balance": bal}, merge=True)
+        if flows or state:
+            _finance(tx, flows, state)
+        if notify:
+            for d in out:
+                if d["result"] in ("approved", "rejected"):
+                    _outbox_entry(tx, int(d["tg_id"]), notify(kind, d))
+        return out, changed
+
+    out, changed = run_transaction(txn)
+    for uid, bal in changed.items():
+        balances.set(uid, bal)
+    return out
+
+# Group post index: "{chat_id}:{message_id}" -> {kind, req_id} for every
+# message of a deposit/withdraw post, so an admin reply resolves to its
+# request with one cached lookup. Misses are cached too (value None).
+group_post_cache = LRUCache(GROUP_POST_CACHE)
+
+def _post_key(chat_id: int, message_id: int) -> str:
+    return f"{chat_id}:{message_id}"
+
+def map_group_post(chat_id: int, message_ids: list, kind: str, req_id: str):
+    batch = client().batch()
+    for mid in message_ids:
+        key = _post_key(chat_id, mid)
+        post = {"chat_id": chat_id, "message_id": mid, "kind": kind, "req_id": req_id}
+        batch.set(group_posts().document(key), post)
+        group_post_cache.set(key, post)
+    batch.commit()
+
+def cached_group_post(chat_id: int, message_id: int):
+    # (hit, post) from memory only
+    post = group_post_cache.get(_post_key(chat_id, message_id), _UNKNOWN)
+    return post is not _UNKNOWN, (None if post is _UNKNOWN else post)
+
+def get_group_post(chat_id: int, message_id: int):
+    hit, post = cached_group_post(chat_id, message_id)
+    if not hit:
+        key = _post_key(chat_id, message_id)
+        snap = group_posts().document(key).get()
+        post = snap.to_dict() if snap.exists else None
+        group_post_cache.set(key, post)
+    return post
+
+# Ledger history: one indexed query per page (tg_id ==, created_at desc).
+# cursor is the created_at of the last (next) or first (prev) entry shown.
+def ledger_page(tg_id: int, cursor: str = None, direction: str = "next", limit: int = 5):
+    order = firestore.Query.DESCENDING if direction == "next" else firestore.Query.ASCENDING
+    q = ledger().where("tg_id", "==", tg_id).order_by("created_at", direction=order)
+    if cursor:
+        q = q.start_after({"created_at": cursor})
+    rows = [s.to_dict() for s in q.limit(limit + 1).stream()]
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if direction != "next":
+        rows.reverse()
+    return rows, more
+
+def reconcile_balance(tg_id: int) -> dict:
+    # balance field vs. sum of ledger entries (streams this user's ledger)
+    snap = get_user_doc(tg_id).get()
+    bal = float(snap.to_dict().get("balance", 0.0)) if snap.exists else 0.0
+    total, count = 0.0, 0
+    for s in ledger().where("tg_id", "==", tg_id).stream():
+        total += float(s.to_dict().get("amount", 0.0))
+        count += 1
+    return {"balance": round(bal, 2), "ledger": round(total, 2), "entries": count, "diff": round(bal - total, 2)}
+
+# Outbox: user notifications are written in the same transaction as the
+# change they report and sent later by bot/outbox.py. A claim pushes next_at
+# out by the lease, so one query (status ==, next_at <=) finds both new
+# messages and ones whose sender died mid-send.
+def _outbox_entry(tx, chat_id: int, text: str):
+    doc = outbox().document()
+    tx.set(doc, {
+        "msg_id": doc.id, "chat_id": chat_id, "text": text, "status": "pending",
+        "attempts": 0, "next_at": now_iso(), "created_at": now_iso(),
+    })
+
+def outbox_claim(limit: int, lease_sec: float) -> list:
+    now = datetime.utcnow()
+    q = (outbox().where("status", "==", "pending").where("next_at", "<=", now.isoformat())
+         .order_by("next_at").limit(limit))
+    until = (now + timedelta(seconds=lease_sec)).isoformat()
+
+    def txn(tx):
+        rows = []
+        for s in tx.get(q):
+            d = s.to_dict()
+            d["attempts"] = int(d.get("attempts", 0)) + 1
+            tx.update(s.reference, {"next_at": until, "attempts": d["attempts"]})
+            rows.append(d)
+        return rows
+
+    return run_transaction(txn)
+
+def outbox_done(msg_id: str, status: str = "sent", error: str = None):
+    # status: sent (nothing left to keep: deleted) | failed (gave up / user
+    # blocked the bot: kept OUTBOX_KEEP_FAILED_DAYS for a look, see outbox_prune)
+    ref = outbox().document(msg_id)
+    if status == "sent":
+        ref.delete()
+        return
+    expire = (datetime.utcnow() + timedelta(days=OUTBOX_KEEP_FAILED_DAYS)).isoformat()
+    ref.update({"status": status, "error": error, "done_at": now_iso(), "expire_at": expire})
+
+def outbox_retry(msg_id: str, delay: float, error: str = None):
+    at = (datetime.utcnow() + timedelta(seconds=delay)).isoformat()
+    outbox().document(msg_id).update({"next_at": at, "error": error})
+
+def outbox_prune(limit: int = 400) -> int:
+    # delete failed messages past their expire_at (single-field range, no composite index)
+    batch, n = client().batch(), 0
+    for snap in outbox().where("expire_at", "<=", now_iso()).limit(limit).stream():
+        batch.delete(snap.reference)
+        n += 1
+    if n:
+        batch.commit()
+    return n
+
+def outbox_backlog() -> int:
+    return int(outbox().where("status", "==", "pending").count().get()[0][0].value)
+
+# Broadcast jobs
+def create_broadcast(data: dict) -> str:
+    doc = broadcasts().document()
+    doc.set({"job_id": doc.id, **data})
+    return doc.id
+
+def update_broadcast(job_id: str, data: dict):
+    broadcasts().document(job_id).update(data)
+
+def running_broadcasts() -> list:
+    return [s.to_dict() for s in broadcasts().where("status", "==", "running").stream()]
+
+# Counts (maintained sharded counters: constant reads however many users there are)
+def count_users() -> int:
+    refs = _counter_refs(stats(), "users")
+    snaps = {s.id: s for s in client().get_all(refs)}
+    return _user_total(refs, snaps)
+
+def _user_total(refs: list, snaps: dict) -> int:
+    base = snaps.get(refs[0].id)
+    if base is None or not base.exists or not base.to_dict().get("seeded"):
+        return rebuild_user_count()
+    return int(_sum_counters(snaps.get(r.id) for r in refs).get("total", 0))
+
+def rebuild_user_count() -> int:
+    # one aggregation query (no document reads) to seed/repair the counter;
+    # the total goes into the base doc and the shards restart from zero
+    total = int(users().count().get()[0][0].value)
+    refs = _counter_refs(stats(), "users")
+    batch = client().batch()
+    batch.set(refs[0], {"total": total, "seeded": True}, merge=True)
+    for ref in refs[1:]:
+        batch.set(ref, {"total": 0}, merge=True)
+    batch.commit()
+    return total
+
+def user_stats(day: str = None) -> dict:
+    day = day or today()
+    total_refs, daily_refs = _counter_refs(stats(), "users"), _counter_refs(stats_daily(), day)
+    snaps = {s.reference.path: s for s in client().get_all(total_refs + daily_refs)}
+    total = _user_total(total_refs, {r.id: snaps.get(r.path) for r in total_refs})
+    daily = _sum_counters(snaps.get(r.path) for r in daily_refs)
+    return {
+        "day": day, "total": total,
+        "new_users": int(daily.get("new_users", 0)), "active_users": int(daily.get("active_users", 0)),
+    }
+
+# Finance aggregates: finance/total (all time) and finance/{day} (UTC day
+# of the decision / sale), kept current with Increment writes inside the
+# same transactions that move the money, so they cost no extra reads. Both
+# are sharded counters (total_{i}, {day}_{i}): every sale writes them, so a
+# single doc would serialise all purchases of all products.
+#   flows (daily + total): {deposits,withdraws}_approved[_amount], *_rejected,
+#       withdraw_fees, sales, sales_amount, products.{pid}.{name,sales,amount}
+#   state (total only): {deposits,withdraws}_pending[_amount], balances
+# rebuild_finance() recomputes everything from the raw collections.
+FINANCE_TOTAL = "total"
+
+def _approved_flows(kind: str, d: dict) -> dict:
+    amount = float(d.get("amount", 0))
+    if kind == "dep":
+        return {"deposits_approved": 1, "deposits_approved_amount": amount}
+    return {"withdraws_approved": 1, "withdraws_approved_amount": amount, "withdraw_fees": float(d.get("fee", 0))}
+
+def _sale_flows(pid: str, name: str, price: float) -> dict:
+    return {"sales": 1, "sales_amount": price, "products": {pid: {"name": name or pid, "sales": 1, "amount": price}}}
+
+def _increments(values: dict) -> dict:
+    return {
+        k: _increments(v) if isinstance(v, dict) else v if isinstance(v, str) else firestore.Increment(v)
+        for k, v in values.items()
+    }
+
+def _finance(tx, flows: dict = None, state: dict = None, day: str = None):
+    # tx: transaction or batch; write-only, so safe after the reads
+    total = {**(flows or {}), **(state or {})}
+    if total:
+        tx.set(_counter_shard(finance(), FINANCE_TOTAL), _increments(total), merge=True)
+    if flows:
+        day = day or today()
+        tx.set(_counter_shard(finance(), day), {"day": day, **_increments(flows)}, merge=True)
+
+def finance_report(day: str = None) -> dict:
+    # base docs (written by rebuild_finance) plus all shards, one get_all
+    day = day or today()
+    total_refs, day_refs = _counter_refs(finance(), FINANCE_TOTAL), _counter_refs(finance(), day)
+    snaps = {s.id: s for s in client().get_all(total_refs + day_refs)}
+    return {
+        "day": day,
+        "today": _sum_counters(snaps.get(r.id) for r in day_refs),
+        "total": _sum_counters(snaps.get(r.id) for r in total_refs),
+    }
+
+def _finance_doc(doc_id: str) -> str:
+    # "total_3" / "2026-01-02_3" -> the aggregate it's a shard of
+    base, _, shard = doc_id.rpartition("_")
+    return base if base and shard.isdigit() else doc_id
+
+def _flatten(d: dict, prefix: str = "") -> dict:
+    out = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            out.update(_flatten(v, f"{prefix}{k}."))
+        elif k not in ("day", "seeded", "name", "rebuilt_at"):
+            out[prefix + k] = float(v or 0)
+    return out
+
+def rebuild_finance(fix: bool = False) -> dict:
+    # One streaming pass over deposits, withdraws, orders and users; only the
+    # per-day sums are held in memory. Returns the drift against the stored
+    # docs as [(doc, field, stored, actual)]; fix=True overwrites the docs
+    # that drifted. Writes racing the scan can show up as drift, so fix
+    # while it's quiet.
+    days, total, scanned = {}, {}, 0
+
+    def flow(day: str, values: dict):
+        day = day or "undated"
+        _add(days.setdefault(day, {"day": day}), values)
+        _add(total, values)
+
+    for kind in ("dep", "wd"):
+        name = "deposits" if kind == "dep" else "withdraws"
+        for s in requests(kind).stream():
+            scanned += 1
+            d = s.to_dict()
+            status = d.get("status")
+            if status == "pending":
+                _add(total, {f"{name}_pending": 1, f"{name}_pending_amount": float(d.get("amount", 0))})
+            elif status == "approved":
+                flow((d.get("approved_at") or d.get("created_at") or "")[:10], _approved_flows(kind, d))
+            elif status == "rejected":
+                flow((d.get("rejected_at") or d.get("created_at") or "")[:10], {f"{name}_rejected": 1})
+    for s in orders().stream():
+        scanned += 1
+        o = s.to_dict()
+        flow((o.get("created_at") or "")[:10], _sale_flows(o.get("pid"), o.get("name"), float(o.get("price", 0))))
+    balance = 0.0
+    for s in users().stream():
+        scanned += 1
+        balance += float(s.to_dict().get("balance", 0.0))
+    total["balances"] = balance
+
+    expected = {FINANCE_TOTAL: total, **days}
+    stored, docs = {}, {}
+    for s in finance().stream():
+        doc_id = _finance_doc(s.id)
+        _add(stored.setdefault(doc_id, {}), s.to_dict())
+        docs.setdefault(doc_id, []).append(s.reference)
+    drift, dirty = [], []
+    for doc_id in sorted(set(expected) | set(stored)):
+        want, have = _flatten(expected.get(doc_id, {})), _flatten(stored.get(doc_id, {}))
+        rows = [
+            (doc_id, f, have.get(f, 0.0), want.get(f, 0.0))
+            for f in sorted(set(want) | set(have))
+            if abs(have.get(f, 0.0) - want.get(f, 0.0)) > 0.005
+        ]
+        if rows or (doc_id == FINANCE_TOTAL and not stored.get(doc_id, {}).get("seeded")):
+            dirty.append(doc_id)
+        drift.extend(rows)
+    if fix:
+        # the exact figures go into the base doc; its shards restart from zero
+        for doc_id in dirty:
+            batch = client().batch()
+            for ref in docs.get(doc_id, []):
+                batch.delete(ref)
+            if doc_id in expected:
+                data = expected[doc_id]
+                if doc_id == FINANCE_TOTAL:
+                    data = {**data, "seeded": True, "rebuilt_at": now_iso()}
+                batch.set(finance().document(doc_id), data)
+            batch.commit()
+    return {"scanned": scanned, "days": len(days), "drift": drift, "fixed": len(dirty) if fix else 0}
+
+# Products
+def _split_stock(stock: int, shards: int) -> list:
+    base, extra = divmod(stock, shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+def create_product(name: str, price: float, stock: int, delivery: str, shards: int = STOCK_SHARDS, pool: bool = False, category: str = "") -> str:
+    doc = products().document()
+    data = {
+        "name": name, "price": price, "stock": stock, "delivery": delivery, "category": category,
+        "created_at": now_iso()
+    }
+    if pool:
+        # stock is the number of unused codes (see add_codes / pool_stock)
+        doc.set({**data, "stock": 0, "pool": True})
+        return doc.id
+    if shards <= 1:
+        doc.set(data)
+        return doc.id
+
+    # Hot products: stock lives in N shard docs so buyers don't all write one doc
+    batch = client().batch()
+    batch.set(doc, {**data, "shards": shards})
+    for i, n in enumerate(_split_stock(stock, shards)):
+        batch.set(stock_shards(doc.id).document(str(i)), {"stock": n})
+    batch.commit()
+    return doc.id
+
+def sharded_stock(pid: str) -> int:
+    return sum(int(s.get("stock") or 0) for s in stock_shards(pid).stream())
+
+# Code pool: products with "pool": True sell one unique item per unit from
+# products/{pid}/codes. Each code doc carries a random "r" so concurrent
+# buyers start their search at different codes instead of all contending
+# for the first unused one. Stock is the count of unused codes.
+def _code_id(code: str) -> str:
+    return hashlib.sha1(code.encode()).hexdigest()[:20]
+
+def add_codes(pid: str, items: list) -> dict:
+    # Chunked batch writes; a code already in the pool (used or not) is
+    # skipped, so re-uploading a file never resells anything.
+    items = list(dict.fromkeys(i for i in items if i))
+    added = skipped = 0
+    for i in range(0, len(items), CODE_BATCH_SIZE):
+        chunk = items[i:i + CODE_BATCH_SIZE]
+        refs = [codes(pid).document(_code_id(c)) for c in chunk]
+        exists = {s.id for s in client().get_all(refs) if s.exists}
+        batch = client().batch()
+        for code, ref in zip(chunk, refs):
+            if ref.id in exists:
+                skipped += 1
+                continue
+            batch.set(ref, {"code": code, "used": False, "r": random.random(), "added_at": now_iso()})
+            added += 1
+        batch.commit()
+    return {"added": added, "skipped": skipped}
+
+def pool_stock(pid: str) -> int:
+    return int(codes(pid).where("used", "==", False).count().get()[0][0].value)
+
+def _claim_code(tx, pid: str):
+    r = random.random()
+    unused = codes(pid).where("used", "==", False)
+    for q in (unused.where("r", ">=", r).order_by("r"), unused.where("r", "<", r).order_by("r")):
+        for s in tx.get(q.limit(1)):
+            return s.reference, s.to_dict()["code"]
+    return None
+
+def reshard_product(pid: str, shards: int):
+    # Move a product's stock to `shards` shard docs (1 = back into the product doc)
+    pref = products().document(pid)
+
+    def txn(tx):
+        snap = pref.get(transaction=tx)
+        if not snap.exists or snap.to_dict().get("pool"):
+            return False
+        p = snap.to_dict()
+        old = int(p.get("shards") or 1)
+        if old > 1:
+            refs = [stock_shards(pid).document(str(i)) for i in range(old)]
+            total = sum(int(s.get("stock") or 0) for s in client().get_all(refs, transaction=tx) if s.exists)
+        else:
+            total = int(p.get("stock") or 0)
+        for i in range(shards if shards > 1 else 0, old if old > 1 else 0):
+            tx.delete(stock_shards(pid).document(str(i)))
+        if shards > 1:
+            for i, n in enumerate(_split_stock(total, shards)):
+                tx.set(stock_shards(pid).document(str(i)), {"stock": n})
+        tx.update(pref, {"stock": total, "shards": shards})
+        return True
+
+    return run_transaction(txn)
+
+def list_products():
+    out = []
+    for s in products().stream():
+        p = s.to_dict()
+        out.append((s.id, p))
+    return out
+
+def get_product(pid: str):
+    doc = products().document(pid)
+    snap = doc.get()
+    if not snap.exists:
+        return None
+    return snap.to_dict()
+
+def purchase(tg_id: int, pid: str, notify=None) -> dict:
+    # Stock check/decrement, balance deduction and the order record in one
+    # transaction: one batched read + one commit, no oversell.
+    pref = products().document(pid)
+    uref = get_user_doc(tg_id)
+    oref = orders().document()
+
+    def txn(tx):
+        snaps = {s.id: s for s in client().get_all([pref, uref], transaction=tx)}
+        psnap, usnap = snaps.get(pref.id), snaps.get(uref.id)
+        if psnap is None or not psnap.exists:
+            return {"status": "not_found"}
+        p = psnap.to_dict()
+        price = float(p.get("price", 0))
+        shards = int(p.get("shards") or 1)
+        claim = None
+        if p.get("pool"):
+            claim = _claim_code(tx, pid)
+            if claim is None:
+                return {"status": "out_of_stock", "stock": 0}
+        elif shards > 1:
+            shard = _pick_shard(tx, pid, shards)
+            if shard is None:
+                return {"status": "out_of_stock", "stock": 0}
+            sref, stock = shard
+        else:
+            sref, stock = pref, int(p.get("stock", 0))
+            if stock <= 0:
+                return {"status": "out_of_stock", "stock": 0}
+        bal = float(usnap.to_dict().get("balance", 0.0)) if usnap is not None and usnap.exists else 0.0
+        if bal < price:
+            return {"status": "insufficient_balance"}
+
+        delivery = p.get("delivery", "✅ Delivered!")
+        if claim:
+            cref, code = claim
+            tx.update(cref, {"used": True, "order_id": oref.id, "tg_id": tg_id, "used_at": now_iso()})
+            delivery = f"{delivery}\n\n{code}" if delivery else code
+        else:
+            tx.update(sref, {"stock": stock - 1})
+        tx.set(uref, {"balance": bal - price}, merge=True)
+        _ledger_entry(tx, tg_id, "purchase", -price, bal - price, oref.id, p.get("name"))
+        tx.set(oref, {
+            "order_id": oref.id, "tg_id": tg_id, "pid": pid, "name": p.get("name"),
+            "price": price, "delivery": delivery, "created_at": now_iso(),
+        })
+        _finance(tx, _sale_flows(pid, p.get("name"), price), {"balances": -price})
+        out = {"status": "ok", "order_id": oref.id, "delivery": delivery, "balance": bal - price}
+        if not claim and shards <= 1:
+            out["stock"] = stock - 1
+        if notify:
+            _outbox_entry(tx, tg_id, notify(out))
+        return out
+
+    res = run_transaction(txn)
+    if "balance" in res:
+        balances.set(tg_id, res["balance"])
+    return res
+
+def _pick_shard(tx, pid: str, shards: int):
+    # Random shard first; if it's empty, pick among the ones that still have stock
+    ref = stock_shards(pid).document(str(random.randrange(shards)))
+    snap = ref.get(transaction=tx)
+    if snap.exists and int(snap.get("stock") or 0) > 0:
+        return ref, int(snap.get("stock"))
+    left = [s for s in tx.get(stock_shards(pid).where("stock", ">", 0)) if int(s.get("stock") or 0) > 0]
+    if not left:
+        return None
+    s = random.choice(left)
+    return s.reference, int(s.get("stock"))
+
+def watch_products(callback):
+    # Live listener; callback([(pid, product), ...]) on every change.
+    # Firestore only - local backends rely on TTL + explicit invalidation.
+    if not isinstance(client(), firestore.Client):
+        return None
+    return products().on_snapshot(
+        lambda docs, changes, read_time: callback([(s.id, s.to_dict()) for s in docs])
+    )
+
+def update_product(pid: str, data: dict):
+    products().document(pid).update(data)
+
+def delete_product(pid: str):
+    # code pools can be large: delete them in CODE_BATCH_SIZE chunks first
+    refs = [s.reference for s in codes(pid).stream()]
+    for i in range(0, len(refs), CODE_BATCH_SIZE):
+        batch = client().batch()
+        for ref in refs[i:i + CODE_BATCH_SIZE]:
+            batch.delete(ref)
+        batch.commit()
+    batch = client().batch()
+    for s in stock_shards(pid).stream():
+        batch.delete(s.reference)
+    batch.delete(products().document(pid))
+    batch.commit()
@@ -0,0 +1,141 @@
+# Persistent FSM storage, so half-finished deposit/withdraw flows survive a
+# restart and can be shared by several worker processes.
+#   FSM_STORAGE=memory  aiogram's MemoryStorage (default, lost on restart)
+#   FSM_STORAGE=sqlite  SQLiteStorage below (local WAL file)
+#   FSM_STORAGE=redis   aiogram's RedisStorage (needs `pip install redis`)
+# Abandoned flows expire after FSM_TTL_SEC of inactivity.
+import json
+import sqlite3
+import time
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from .config import FSM_STORAGE, FSM_SQLITE_PATH, FSM_REDIS_URL, FSM_TTL_SEC
+
+# purge expired rows roughly every N writes
+PURGE_EVERY = 1000
+
+def _key(key: StorageKey) -> str:
+    return ":".join(str(p) for p in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny,
+    ))
+
+class SQLiteStorage(BaseStorage):
+    # One row per key with a sliding expiry. Every call is a single
+    # primary-key statement on a local WAL file (tens of microseconds),
+    # so it runs inline instead of hopping to a thread. The file is opened
+    # on first use, not when the Dispatcher is built.
+    def __init__(self, path: str = FSM_SQLITE_PATH, ttl: float = FSM_TTL_SEC):
+        self.path = path
+        self.ttl = ttl
+        self._writes = 0
+        self._db = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout = 5000")
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', expires REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS fsm_expires ON fsm (expires)")
+            self._db = conn
+        return self._db
+
+    def _expires(self) -> float:
+        return time.time() + self.ttl if self.ttl else float("inf")
+
+    def _row(self, k: str):
+        row = self._conn.execute("SELECT state, data, expires FROM fsm WHERE key = ?", (k,)).fetchone()
+        if row is None or row[2] <= time.time():
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            self.purge()
+
+    def purge(self) -> int:
+        return self._conn.execute("DELETE FROM fsm WHERE expires <= ?", (time.time(),)).rowcount
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        state = state.state if isinstance(state, State) else state
+        k = _key(key)
+        if state is None:
+            # keep data if any, drop the row once both are empty
+            self._conn.execute("UPDATE fsm SET state = NULL WHERE key = ?", (k,))
+            self._conn.execute("DELETE FROM fsm WHERE key = ? AND data = '{}'", (k,))
+        else:
+            # an expired row counts as absent: its old data doesn't come back
+            self._conn.execute(
+                "INSERT INTO fsm (key, state, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, expires = excluded.expires, "
+                "data = CASE WHEN fsm.expires <= ? THEN '{}' ELSE fsm.data END",
+                (k, state, self._expires(), time.time()),
+            )
+        self._wrote()
+
+    async def get_state(self, key: StorageKey):
+        return self._row(_key(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        k = _key(key)
+        if not data:
+            self._conn.execute("UPDATE fsm SET data = '{}' WHERE key = ?", (k,))
+            self._conn.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL", (k,))
+        else:
+            self._conn.execute(
+                "INSERT INTO fsm (key, data, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data, expires = excluded.expires, "
+                "state = CASE WHEN fsm.expires <= ? THEN NULL ELSE fsm.state END",
+                (k, json.dumps(dict(data)), self._expires(), time.time()),
+            )
+        self._wrote()
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return self._row(_key(key))[1]
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> dict:
+        # read-modify-write in one local transaction
+        k = _key(key)
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            state, current = self._row(k)
+            current.update(data)
+            self._conn.execute(
+                "INSERT INTO fsm (key, state, data, expires) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, expires = excluded.expires",
+                (k, state, json.dumps(current), self._expires()),
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._wrote()
+        return current.copy()
+
+    async def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+def make_storage(kind: str = FSM_STORAGE) -> BaseStorage:
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "sqlite":
+        return SQLiteStorage(FSM_SQLITE_PATH, FSM_TTL_SEC)
+    if kind == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage
+        ttl = int(FSM_TTL_SEC) or None
+        return RedisStorage.from_url(FSM_REDIS_URL, state_ttl=ttl, data_ttl=ttl)
+    raise RuntimeError(f"Unknown FSM_STORAGE: {kind}")
@@ -35,7 +35,8 @@ def admin_panel() -> ReplyKeyboardMarkup:
         keyboard=[
             [KeyboardButton(text="👥 Total Users"), KeyboardButton(text="📦 Products")],
             [KeyboardButton(text="➕ Add Product"), KeyboardButton(text="📢 Broadcast")],
-            [KeyboardButton(text="⬅️ Back")],
+            [KeyboardButton(text="📥 Pending"), KeyboardButton(text="📈 Stats")],
+            [KeyboardButton(text="📊 Report"), KeyboardButton(text="⬅️ Back")],
         ],
         resize_keyboard=True
     )
@@ -48,3 +49,104 @@ def approve_reject(kind: str, req_id: str) -> InlineKeyboardMarkup:
             InlineKeyboardButton(text="❌ Reject", callback_data=f"{kind}:no:{req_id}"),
         ]
     ])
+
+def history_nav(prev_cursor: str = None, next_cursor: str = None):
+    # cursor = created_at of the edge entry on the current page
+    row = []
+    if prev_cursor:
+        row.append(InlineKeyboardButton(text="◀️ Prev", callback_data=f"hist:p:{prev_cursor}"))
+    if next_cursor:
+        row.append(InlineKeyboardButton(text="Next ▶️", callback_data=f"hist:n:{next_cursor}"))
+    if not row:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
+# Pending queue: one toggle button per request, the selection lives in the
+# message's own keyboard (☑️ = selected), so no server-side state is needed.
+SELECTED, UNSELECTED = "☑️", "⬜"
+
+def pending_queue(kind: str, rows: list, prev_cursor: str = None, next_cursor: str = None) -> InlineKeyboardMarkup:
+    kb = []
+    for d in rows:
+        label = f"{UNSELECTED} {float(d.get('amount', 0)):g} BDT · {d.get('method', '')} · {d.get('tg_id')}"
+        kb.append([InlineKeyboardButton(text=label, callback_data=f"pq:t:{kind}:{d['req_id']}")])
+    nav = []
+    if prev_cursor:
+        nav.append(InlineKeyboardButton(text="◀️ Prev", callback_data=f"pq:p:{kind}:{prev_cursor}"))
+    if rows:
+        nav.append(InlineKeyboardButton(text=f"{SELECTED} All", callback_data=f"pq:a:{kind}"))
+    if next_cursor:
+        nav.append(InlineKeyboardButton(text="Next ▶️", callback_data=f"pq:n:{kind}:{next_cursor}"))
+    if nav:
+        kb.append(nav)
+    if rows:
+        kb.append([
+            InlineKeyboardButton(text="✅ Approve selected", callback_data=f"pq:ok:{kind}"),
+            InlineKeyboardButton(text="❌ Reject selected", callback_data=f"pq:no:{kind}"),
+        ])
+    kb.append([
+        InlineKeyboardButton(text="🧾 Deposits", callback_data="pq:v:dep"),
+        InlineKeyboardButton(text="🏧 Withdraws", callback_data="pq:v:wd"),
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+def _toggle(button: InlineKeyboardButton, on: bool) -> InlineKeyboardButton:
+    text = button.text.split(" ", 1)[1]
+    return button.model_copy(update={"text": f"{SELECTED if on else UNSELECTED} {text}"})
+
+def toggle_pending(markup: InlineKeyboardMarkup, req_id: str = None) -> InlineKeyboardMarkup:
+    # req_id=None: select all (or clear all if everything is selected)
+    toggles = [b for row in markup.inline_keyboard for b in row if b.callback_data.startswith("pq:t:")]
+    select_all = not all(b.text.startswith(SELECTED) for b in toggles)
+    rows = []
+    for row in markup.inline_keyboard:
+        new = []
+        for b in row:
+            if not b.callback_data.startswith("pq:t:"):
+                new.append(b)
+            elif req_id is None:
+                new.append(_toggle(b, select_all))
+            elif b.callback_data.endswith(f":{req_id}"):
+                new.append(_toggle(b, not b.text.startswith(SELECTED)))
+            else:
+                new.append(b)
+        rows.append(new)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def selected_pending(markup: InlineKeyboardMarkup) -> list:
+    return [
+        b.callback_data.rsplit(":", 1)[1]
+        for row in markup.inline_keyboard for b in row
+        if b.callback_data.startswith("pq:t:") and b.text.startswith(SELECTED)
+    ]
+
+# Shop: categories, then pages of products. Navigation edits the message in
+# place; callbacks carry indexes into the catalog layout (see catalog.py).
+def shop_categories(cats: list, page: int, pages: int) -> InlineKeyboardMarkup:
+    # cats: [(index, name, product count)] for this page, two per row
+    buttons = [InlineKeyboardButton(text=f"{name} ({n})", callback_data=f"shop:p:{i}:0") for i, name, n in cats]
+    kb = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"shop:c:{page - 1}"))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"shop:c:{page + 1}"))
+    if nav:
+        kb.append(nav)
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+def shop_page(pg: dict) -> InlineKeyboardMarkup:
+    kb = [
+        [InlineKeyboardButton(text=f"🛒 {p.get('name', 'Item')} ({p.get('price', 0)} BDT)", callback_data=f"buy:{pid}")]
+        for pid, p in pg["items"]
+    ]
+    nav = []
+    if pg["page"] > 0:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"shop:p:{pg['cat']}:{pg['page'] - 1}"))
+    if pg["page"] + 1 < pg["pages"]:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"shop:p:{pg['cat']}:{pg['page'] + 1}"))
+    if nav:
+        kb.append(nav)
+    if pg["categories"] > 1:
+        kb.append([InlineKeyboardButton(text="⬅️ Categories", callback_data="shop:c:0")])
+    return InlineKeyboardMarkup(inline_keyboard=kb)
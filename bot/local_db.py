@@ -0,0 +1,357 @@
+# Local storage engine: a SQLite-backed stand-in for the subset of the
+# Firestore client API that firebase_db uses (documents, queries,
+# transactions, batches). path=":memory:" gives a throwaway in-memory store.
+import json
+import secrets
+import sqlite3
+import string
+import threading
+from datetime import datetime
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, NotFound
+
+_ID_CHARS = string.ascii_letters + string.digits
+
+# Fields that get an expression index in every collection
+_INDEXED_FIELDS = ("tg_id", "status", "created_at")
+
+def _new_id() -> str:
+    return "".join(secrets.choice(_ID_CHARS) for _ in range(20))
+
+def _json_path(field: str) -> str:
+    return "$." + field
+
+def _get_field(data: dict, field: str):
+    cur = data
+    for part in field.split("."):
+        if not isinstance(cur, dict) or part not in cur:
+            return None
+        cur = cur[part]
+    return cur
+
+def _resolve(cur, value):
+    if isinstance(value, firestore.Increment):
+        base = cur if isinstance(cur, (int, float)) and not isinstance(cur, bool) else 0
+        return base + value.value
+    if value is firestore.SERVER_TIMESTAMP:
+        return datetime.utcnow().isoformat()
+    return value
+
+def _set_field(data: dict, field: str, value):
+    parts = field.split(".")
+    cur = data
+    for part in parts[:-1]:
+        nxt = cur.get(part)
+        if not isinstance(nxt, dict):
+            nxt = {}
+            cur[part] = nxt
+        cur = nxt
+    if value is firestore.DELETE_FIELD:
+        cur.pop(parts[-1], None)
+    else:
+        cur[parts[-1]] = _resolve(cur.get(parts[-1]), value)
+
+def _merge(base: dict, data: dict) -> dict:
+    for k, v in data.items():
+        if isinstance(v, dict) and isinstance(base.get(k), dict):
+            _merge(base[k], v)
+        elif v is firestore.DELETE_FIELD:
+            base.pop(k, None)
+        elif isinstance(v, dict):
+            base[k] = _merge({}, v)
+        else:
+            base[k] = _resolve(base.get(k), v)
+    return base
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        return json.loads(json.dumps(self._data))
+
+    def get(self, field: str):
+        return _get_field(self._data or {}, field)
+
+class DocumentReference:
+    def __init__(self, client, path: str, doc_id: str):
+        self._client = client
+        self._path = path
+        self.id = doc_id
+
+    @property
+    def path(self) -> str:
+        return f"{self._path}/{self.id}"
+
+    def collection(self, name: str):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, transaction=None):
+        return self._client._get(self)
+
+    def create(self, data: dict):
+        self._client._apply([("create", self, data)])
+
+    def set(self, data: dict, merge: bool = False):
+        self._client._apply([("set_merge" if merge else "set", self, data)])
+
+    def update(self, data: dict):
+        self._client._apply([("update", self, data)])
+
+    def delete(self):
+        self._client._apply([("delete", self, None)])
+
+class Query:
+    def __init__(self, client, path: str, filters=(), orders=(), limit_=None, cursor=None):
+        self._client = client
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit_
+        self._cursor = cursor
+
+    def _copy(self, **kw):
+        args = dict(filters=self._filters, orders=self._orders, limit_=self._limit, cursor=self._cursor)
+        args.update(kw)
+        return Query(self._client, self._path, **args)
+
+    def where(self, field: str, op: str, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field: str, direction: str = "ASCENDING"):
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def limit(self, n: int):
+        return self._copy(limit_=n)
+
+    def start_after(self, snapshot_or_values):
+        return self._copy(cursor=snapshot_or_values)
+
+    def _sql(self):
+        sql = ["SELECT id, data FROM docs WHERE path = ?"]
+        args = [self._path]
+        for field, op, value in self._filters:
+            expr = f"json_extract(data, '{_json_path(field)}')"
+            if op == "==" and value is None:
+                sql.append(f"AND {expr} IS NULL")
+            elif op in ("==", "!=", "<", "<=", ">", ">="):
+                sql.append(f"AND {expr} {'=' if op == '==' else op} ?")
+                args.append(value)
+            elif op == "in":
+                sql.append(f"AND {expr} IN ({','.join('?' * len(value))})")
+                args.extend(value)
+            elif op == "array_contains":
+                sql.append(f"AND EXISTS (SELECT 1 FROM json_each(data, '{_json_path(field)}') WHERE value = ?)")
+                args.append(value)
+            else:
+                raise ValueError(f"unsupported operator: {op}")
+
+        # Like Firestore: ordering excludes docs without the field, ties break on id
+        orders = [(f"json_extract(data, '{_json_path(f)}')", d) for f, d in self._orders]
+        for expr, _ in orders:
+            sql.append(f"AND {expr} IS NOT NULL")
+        last_dir = orders[-1][1] if orders else "ASCENDING"
+        orders.append(("id", last_dir))
+
+        if self._cursor is not None:
+            # A snapshot cursor is exact (order fields + id); a dict cursor
+            # only carries the order_by field values.
+            values = [self._cursor.get(f) for f, _ in self._orders]
+            keys = orders[:len(values)]
+            if isinstance(self._cursor, DocumentSnapshot):
+                values.append(self._cursor.id)
+                keys = orders
+            ors = []
+            for i, (expr, d) in enumerate(keys):
+                eqs = [f"{e} = ?" for e, _ in keys[:i]]
+                cmp = f"{expr} {'<' if d == 'DESCENDING' else '>'} ?"
+                ors.append("(" + " AND ".join(eqs + [cmp]) + ")")
+                args.extend(values[:i + 1])
+            sql.append("AND (" + " OR ".join(ors) + ")")
+
+        sql.append("ORDER BY " + ", ".join(f"{e} {'DESC' if d == 'DESCENDING' else 'ASC'}" for e, d in orders))
+        if self._limit is not None:
+            sql.append("LIMIT ?")
+            args.append(self._limit)
+        return " ".join(sql), args
+
+    def stream(self, transaction=None):
+        sql, args = self._sql()
+        rows = self._client._query(sql, args)
+        col = CollectionReference(self._client, self._path)
+        for doc_id, data in rows:
+            yield DocumentSnapshot(col.document(doc_id), json.loads(data))
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def count(self, alias: str = None):
+        return AggregationQuery(self, alias or "count")
+
+class AggregationResult:
+    def __init__(self, alias: str, value):
+        self.alias = alias
+        self.value = value
+
+class AggregationQuery:
+    def __init__(self, query, alias: str):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None):
+        sql, args = self._query._sql()
+        row = self._query._client._query(f"SELECT COUNT(*) FROM ({sql})", args)[0]
+        return [[AggregationResult(self._alias, row[0])]]
+
+class CollectionReference(Query):
+    def __init__(self, client, path: str):
+        super().__init__(client, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id: str = None):
+        return DocumentReference(self._client, self._path, doc_id or _new_id())
+
+    def add(self, data: dict):
+        ref = self.document()
+        ref.create(data)
+        return None, ref
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def create(self, ref, data: dict):
+        self._writes.append(("create", ref, data))
+
+    def set(self, ref, data: dict, merge: bool = False):
+        self._writes.append(("set_merge" if merge else "set", ref, data))
+
+    def update(self, ref, data: dict):
+        self._writes.append(("update", ref, data))
+
+    def delete(self, ref):
+        self._writes.append(("delete", ref, None))
+
+    def commit(self):
+        self._client._apply(self._writes)
+        self._writes = []
+
+class Transaction(WriteBatch):
+    def get(self, ref_or_query):
+        # same contract as Firestore: a document (as a one-item iterator) or
+        # a query; a bare collection is rejected there, so it is here too
+        if isinstance(ref_or_query, DocumentReference):
+            return iter([ref_or_query.get()])
+        if isinstance(ref_or_query, Query) and not isinstance(ref_or_query, CollectionReference):
+            return ref_or_query.stream()
+        raise ValueError('Value for argument "ref_or_query" must be a DocumentReference or a Query.')
+
+class LocalClient:
+    def __init__(self, path: str = ":memory:"):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA busy_timeout = 5000")
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "path TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (path, id)) WITHOUT ROWID"
+        )
+        for field in _INDEXED_FIELDS:
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS docs_{field} "
+                f"ON docs (path, json_extract(data, '{_json_path(field)}'))"
+            )
+
+    def collection(self, path: str):
+        return CollectionReference(self, path)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references, transaction=None):
+        with self._lock:
+            return [DocumentSnapshot(ref, self._read(ref)) for ref in references]
+
+    def run_transaction(self, fn):
+        # BEGIN IMMEDIATE takes the write lock up front, so reads inside fn
+        # stay valid until commit (also across processes sharing the file).
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                tx = Transaction(self)
+                result = fn(tx)
+                self._write_all(tx._writes)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return result
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # -- internals --
+    def _query(self, sql: str, args):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def _read(self, ref):
+        row = self._conn.execute(
+            "SELECT data FROM docs WHERE path = ? AND id = ?", (ref._path, ref.id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _get(self, ref):
+        with self._lock:
+            return DocumentSnapshot(ref, self._read(ref))
+
+    def _apply(self, writes):
+        if not writes:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_all(writes)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _write_all(self, writes):
+        for kind, ref, data in writes:
+            cur = self._read(ref)
+            if kind == "delete":
+                self._conn.execute("DELETE FROM docs WHERE path = ? AND id = ?", (ref._path, ref.id))
+                continue
+            if kind == "create":
+                if cur is not None:
+                    raise AlreadyExists(f"Document already exists: {ref.path}")
+                new = _merge({}, data)
+            elif kind == "set":
+                new = _merge({}, data)
+            elif kind == "set_merge":
+                new = _merge(cur or {}, data)
+            else:
+                if cur is None:
+                    raise NotFound(f"No document to update: {ref.path}")
+                new = cur
+                for field, value in data.items():
+                    _set_field(new, field, value)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO docs (path, id, data) VALUES (?, ?, ?)",
+                (ref._path, ref.id, json.dumps(new)),
+            )
@@ -1,24 +1,52 @@
 import asyncio
+import csv
+import io
+from contextlib import asynccontextmanager
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, CallbackQuery, URLInputFile, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import CommandStart
+from aiogram.types import Message, CallbackQuery
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.fsm.context import FSMContext
-from firebase_admin import firestore
 
 from .config import (
     BOT_TOKEN, ADMIN_ID,
     WITHDRAW_GROUP_ID, DEPOSIT_GROUP_ID,
-    BANNER_IMAGE_URL,
     BKASH_NUMBER, NAGAD_NUMBER, BINANCE_ID, CRYPTO_ADDRESS,
     MIN_WITHDRAW_BDT, WITHDRAW_FEE_PCT, USD_RATE_BDT,
-    SUPPORT_USERNAME,
+    SUPPORT_USERNAME, HISTORY_PAGE_SIZE, PENDING_PAGE_SIZE, SHOP_PAGE_SIZE,
+    METRICS_HOST, METRICS_PORT,
+    RUN_MODE, WORKER_INDEX, CALLBACK_DEDUP_TTL_SEC,
 )
 from .states import DepositFlow, WithdrawFlow, AdminAddProduct, AdminBroadcast
-from .keyboards import main_menu, deposit_methods, withdraw_methods, admin_panel, approve_reject
-from . import firebase_db as db
-
-bot = Bot(BOT_TOKEN)
-dp = Dispatcher()
+from .keyboards import (
+    main_menu, deposit_methods, withdraw_methods, admin_panel, approve_reject, history_nav,
+    pending_queue, toggle_pending, selected_pending, shop_categories, shop_page,
+)
+from .middlewares import ActivityMiddleware, ThrottleMiddleware
+from .fsm_storage import make_storage
+from .cache import LRUCache
+from . import storage as db
+from . import broadcast
+from . import media
+from . import catalog
+from . import metrics
+from . import outbox
+
+# The Bot is built by create_bot() when the bot actually runs, so importing
+# this module (tools, benchmarks, webhook workers) needs no token.
+bot: Bot = None
+dp = Dispatcher(storage=make_storage())
+dp.update.outer_middleware(ActivityMiddleware())
+throttle = ThrottleMiddleware()
+dp.message.outer_middleware(throttle)
+dp.callback_query.outer_middleware(throttle)
+dp.message.middleware(metrics.HandlerMetricsMiddleware())
+dp.callback_query.middleware(metrics.HandlerMetricsMiddleware())
+
+def create_bot(session=None) -> Bot:
+    global bot
+    bot = Bot(BOT_TOKEN, session=session) if session else Bot(BOT_TOKEN)
+    bot.session.middleware(metrics.RequestMetricsMiddleware())
+    return bot
 
 def is_admin(uid: int) -> bool:
     return uid == ADMIN_ID
@@ -46,7 +74,7 @@ def payment_details(method: str) -> str:
 @dp.message(CommandStart())
 async def start(m: Message, state: FSMContext):
     await state.clear()
-    db.ensure_user(m.from_user.id, m.from_user.full_name)
+    await db.ensure_user(m.from_user.id, m.from_user.full_name)
     await m.answer("✅ Welcome! Use menu ⬇️", reply_markup=main_menu(is_admin(m.from_user.id)))
 
 # ---------------- Back ----------------
@@ -58,7 +86,7 @@ async def back(m: Message, state: FSMContext):
 # ---------------- Wallet ----------------
 @dp.message(F.text == "💰 Wallet")
 async def wallet(m: Message):
-    bal = db.get_balance(m.from_user.id)
+    bal = await db.get_balance(m.from_user.id)
     await m.answer(f"💰 Balance: {bal:.2f} BDT")
 
 # ---------------- Support ----------------
@@ -67,31 +95,44 @@ async def support(m: Message):
     await m.answer(f"🆘 Support: {SUPPORT_USERNAME}")
 
 # ---------------- History ----------------
+LEDGER_ICONS = {"deposit": "➕", "withdraw": "🏧", "purchase": "🛒", "admin": "🛠"}
+
+async def history_page(uid: int, cursor: str = None, direction: str = "next"):
+    rows, more = await db.ledger_page(uid, cursor, direction, HISTORY_PAGE_SIZE)
+    if not rows:
+        return "🧾 History\n\n• None", None
+
+    lines = ["🧾 History\n"]
+    for e in rows:
+        when = (e.get("created_at") or "")[:16].replace("T", " ")
+        lines.append(
+            f"{LEDGER_ICONS.get(e.get('kind'), '•')} {e.get('kind')} {float(e.get('amount', 0)):+.2f} BDT"
+            f" | Bal {float(e.get('balance', 0)):.2f} | {when}"
+        )
+
+    # paging forward: older entries exist if `more`; newer ones exist if we had a cursor
+    has_older = more if direction == "next" else bool(cursor)
+    has_newer = bool(cursor) if direction == "next" else more
+    kb = history_nav(
+        rows[0]["created_at"] if has_newer else None,
+        rows[-1]["created_at"] if has_older else None,
+    )
+    return "\n".join(lines), kb
+
 @dp.message(F.text == "🧾 History")
 async def history(m: Message):
-    # last 5 deposits + withdraws + purchases
-    deps = db.deposits().where("tg_id", "==", m.from_user.id).order_by("created_at", direction=firestore.Query.DESCENDING).limit(5).stream()
-    wds = db.withdraws().where("tg_id", "==", m.from_user.id).order_by("created_at", direction=firestore.Query.DESCENDING).limit(5).stream()
-
-    lines = ["🧾 History (last 5)\n", "➕ Deposits:"]
-    dep_list = list(deps)
-    if dep_list:
-        for s in dep_list:
-            d = s.to_dict()
-            lines.append(f"• {d.get('method')} | {d.get('amount')} | {d.get('status')}")
-    else:
-        lines.append("• None")
-
-    lines.append("\n🏧 Withdraws:")
-    wd_list = list(wds)
-    if wd_list:
-        for s in wd_list:
-            d = s.to_dict()
-            lines.append(f"• {d.get('method')} | {d.get('amount')} | {d.get('status')}")
-    else:
-        lines.append("• None")
+    text, kb = await history_page(m.from_user.id)
+    await m.answer(text, reply_markup=kb)
 
-    await m.answer("\n".join(lines))
+@dp.callback_query(F.data.startswith("hist:"))
+async def history_nav_cb(c: CallbackQuery):
+    _, direction, cursor = c.data.split(":", 2)
+    text, kb = await history_page(c.from_user.id, cursor, "next" if direction == "n" else "prev")
+    try:
+        await c.message.edit_text(text, reply_markup=kb)
+    except:
+        pass
+    await c.answer()
 
 # ---------------- Deposit ----------------
 @dp.message(F.text == "➕ Deposit")
@@ -137,7 +178,7 @@ async def deposit_screenshot(m: Message, state: FSMContext):
     if not m.photo:
         return await m.answer("❌ Please send a screenshot photo.")
 
-    await state.update_data(photo_file_id=m.photo[-1].file_id)
+    await state.update_data(photo_file_id=m.photo[-1].file_id, photo_unique_id=m.photo[-1].file_unique_id)
     await m.answer("✍️ Sender info (number/ID/address you paid from):")
     await state.set_state(DepositFlow.sender)
 
@@ -149,6 +190,14 @@ async def deposit_sender(m: Message, state: FSMContext):
     await m.answer("🔑 Enter Transaction ID / Txn Hash:")
     await state.set_state(DepositFlow.txid)
 
+def duplicate_flags(dep: dict) -> str:
+    flags = ""
+    if dep.get("dup_txid"):
+        flags += f"⚠️ *DUPLICATE TxID* (first used in {dep['dup_txid']})\n"
+    if dep.get("dup_photo"):
+        flags += f"⚠️ *DUPLICATE SCREENSHOT* (first used in {dep['dup_photo']})\n"
+    return flags + "\n" if flags else ""
+
 @dp.message(DepositFlow.txid)
 async def deposit_txid(m: Message, state: FSMContext):
     if m.text == "⬅️ Back":
@@ -157,10 +206,7 @@ async def deposit_txid(m: Message, state: FSMContext):
     data = await state.get_data()
     txid = m.text.strip()
 
-    doc = db.deposits().document()
-    req_id = doc.id
-    doc.set({
-        "req_id": req_id,
+    dep = await db.create_deposit({
         "tg_id": m.from_user.id,
         "name": m.from_user.full_name,
         "amount": float(data["amount"]),
@@ -168,10 +214,12 @@ async def deposit_txid(m: Message, state: FSMContext):
         "sender": data["sender"],
         "txid": txid,
         "photo_file_id": data["photo_file_id"],
+        "photo_unique_id": data.get("photo_unique_id"),
         "status": "pending",
         "created_at": db.now_iso(),
         "admin_reply_sent": False,
     })
+    req_id = dep["req_id"]
 
     caption = (
         f"🧾 *NEW DEPOSIT*\n\n"
@@ -181,26 +229,27 @@ async def deposit_txid(m: Message, state: FSMContext):
         f"💵 Amount: *{data['amount']} BDT*\n"
         f"📌 Sender: `{data['sender']}`\n"
         f"🔑 TxID: `{txid}`\n\n"
+        f"{duplicate_flags(dep)}"
         f"🆔 Request ID: `{req_id}`"
     )
 
     try:
-        await bot.send_photo(
-            chat_id=DEPOSIT_GROUP_ID,
-            photo=URLInputFile(BANNER_IMAGE_URL),
-            caption=caption,
-            parse_mode="Markdown",
-            reply_markup=approve_reject("dep", req_id),
+        # Albums can't carry inline keyboards, so the buttons go on a small reply
+        album = await media.send_banner_album(
+            m.bot, DEPOSIT_GROUP_ID, caption, data["photo_file_id"],
+            f"📸 User Screenshot | Request `{req_id}`", parse_mode="Markdown",
         )
-        await bot.send_photo(
-            chat_id=DEPOSIT_GROUP_ID,
-            photo=data["photo_file_id"],
-            caption=f"📸 User Screenshot | Request `{req_id}`",
-            parse_mode="Markdown",
+        buttons = await m.bot.send_message(
+            DEPOSIT_GROUP_ID, f"🆔 Request ID: `{req_id}`", parse_mode="Markdown",
+            reply_markup=approve_reject("dep", req_id), reply_to_message_id=album[0].message_id,
         )
+        posted = album + [buttons]
     except:
-        await bot.send_message(DEPOSIT_GROUP_ID, caption, parse_mode="Markdown", reply_markup=approve_reject("dep", req_id))
-        await bot.send_photo(DEPOSIT_GROUP_ID, data["photo_file_id"], caption=f"📸 Screenshot | Request {req_id}")
+        posted = [
+            await m.bot.send_message(DEPOSIT_GROUP_ID, caption, parse_mode="Markdown", reply_markup=approve_reject("dep", req_id)),
+            await m.bot.send_photo(DEPOSIT_GROUP_ID, data["photo_file_id"], caption=f"📸 Screenshot | Request {req_id}"),
+        ]
+    await db.map_group_post(DEPOSIT_GROUP_ID, [p.message_id for p in posted], "dep", req_id)
 
     await m.answer("✅ Deposit request submitted. Please wait for admin verification.", reply_markup=main_menu(is_admin(m.from_user.id)))
     await state.clear()
@@ -209,7 +258,7 @@ async def deposit_txid(m: Message, state: FSMContext):
 @dp.message(F.text == "🏧 Withdraw")
 async def withdraw_start(m: Message, state: FSMContext):
     await state.clear()
-    bal = db.get_balance(m.from_user.id)
+    bal = await db.get_balance(m.from_user.id)
     await m.answer(
         f"🏧 Withdraw\n\n• Minimum: {MIN_WITHDRAW_BDT} BDT\n• Fee: {WITHDRAW_FEE_PCT}%\n• Rate info: 1$={USD_RATE_BDT} BDT\n\n💰 Balance: {bal:.2f} BDT\n\nSelect method:",
         reply_markup=withdraw_methods()
@@ -251,17 +300,14 @@ async def withdraw_amount(m: Message, state: FSMContext):
     if amt < MIN_WITHDRAW_BDT:
         return await m.answer(f"❌ Minimum withdraw is {MIN_WITHDRAW_BDT} BDT.")
 
-    bal = db.get_balance(m.from_user.id)
+    bal = await db.get_balance(m.from_user.id)
     if amt > bal:
         return await m.answer(f"❌ Insufficient balance. Your balance: {bal:.2f} BDT")
 
     fee = round(amt * WITHDRAW_FEE_PCT / 100, 2)
     receive = round(amt - fee, 2)
 
-    doc = db.withdraws().document()
-    req_id = doc.id
-    doc.set({
-        "req_id": req_id,
+    req_id = await db.create_withdraw({
         "tg_id": m.from_user.id,
         "name": m.from_user.full_name,
         "method": data["method"],
@@ -288,15 +334,13 @@ async def withdraw_amount(m: Message, state: FSMContext):
     )
 
     try:
-        await bot.send_photo(
-            chat_id=WITHDRAW_GROUP_ID,
-            photo=URLInputFile(BANNER_IMAGE_URL),
-            caption=caption,
-            parse_mode="Markdown",
-            reply_markup=approve_reject("wd", req_id),
+        posted = await media.send_banner(
+            m.bot, WITHDRAW_GROUP_ID, caption,
+            parse_mode="Markdown", reply_markup=approve_reject("wd", req_id),
         )
     except:
-        await bot.send_message(WITHDRAW_GROUP_ID, caption, parse_mode="Markdown", reply_markup=approve_reject("wd", req_id))
+        posted = await m.bot.send_message(WITHDRAW_GROUP_ID, caption, parse_mode="Markdown", reply_markup=approve_reject("wd", req_id))
+    await db.map_group_post(WITHDRAW_GROUP_ID, [posted.message_id], "wd", req_id)
 
     await m.answer(
         f"✅ Withdraw request submitted.\nFee: {fee} BDT | You will receive: {receive} BDT\n⏳ Wait for admin approval.",
@@ -305,149 +349,188 @@ async def withdraw_amount(m: Message, state: FSMContext):
     await state.clear()
 
 # ---------------- Group Approve/Reject callbacks ----------------
-@dp.callback_query(F.data.startswith("dep:"))
-async def deposit_approve_reject(c: CallbackQuery):
+# Status, balance and the user's notification commit in one transaction;
+# the notification itself goes out via the outbox sender.
+def decision_text(kind: str, d: dict) -> str:
+    if kind == "dep":
+        if d["result"] == "approved":
+            return f"✅ Deposit approved! +{float(d['amount']):.2f} BDT added."
+        return "❌ Deposit rejected. Please submit correct info."
+    if d["result"] == "approved":
+        return (
+            f"✅ Withdraw approved!\nAmount deducted: {float(d['amount']):.2f} BDT\n"
+            f"Fee: {float(d['fee']):.2f} BDT\nPayable: {float(d['receive']):.2f} BDT"
+        )
+    if d.get("reason") == "insufficient_balance":
+        return "❌ Withdraw rejected (insufficient balance)."
+    return "❌ Withdraw rejected."
+
+# Duplicate taps never reach the database: a callback id is handled once,
+# a request decided in this process answers from memory, and a tap that
+# arrives while the same request is in flight waits for it on a per-request
+# lock. The transaction stays the authority across processes.
+handled_callbacks = LRUCache(10000, CALLBACK_DEDUP_TTL_SEC)
+decided = LRUCache(10000, CALLBACK_DEDUP_TTL_SEC)
+_req_locks = {}
+
+@asynccontextmanager
+async def req_lock(key: str):
+    entry = _req_locks.get(key)
+    if entry is None:
+        entry = _req_locks[key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _req_locks[key]
+
+def seen_callback(c: CallbackQuery) -> bool:
+    if handled_callbacks.get(c.id):
+        return True
+    handled_callbacks.set(c.id, True)
+    return False
+
+async def decide(c: CallbackQuery, kind: str):
     if c.from_user.id != ADMIN_ID:
         return await c.answer("Not allowed", show_alert=True)
+    if seen_callback(c):
+        return
 
     _, action, req_id = c.data.split(":")
-    ref = db.deposits().document(req_id)
-    snap = ref.get()
-    if not snap.exists:
-        return await c.answer("Not found", show_alert=True)
-    d = snap.to_dict()
-
-    if d.get("status") != "pending":
+    key = f"{kind}:{req_id}"
+    if decided.get(key):
         return await c.answer("Already handled", show_alert=True)
 
-    if action == "ok":
-        db.add_balance(int(d["tg_id"]), float(d["amount"]))
-        ref.update({"status": "approved", "approved_at": db.now_iso()})
-        await bot.send_message(int(d["tg_id"]), f"✅ Deposit approved! +{float(d['amount']):.2f} BDT added.")
-        await c.answer("Approved ✅", show_alert=True)
-    else:
-        ref.update({"status": "rejected", "rejected_at": db.now_iso()})
-        await bot.send_message(int(d["tg_id"]), "❌ Deposit rejected. Please submit correct info.")
-        await c.answer("Rejected ❌", show_alert=True)
-
-@dp.callback_query(F.data.startswith("wd:"))
-async def withdraw_approve_reject(c: CallbackQuery):
-    if c.from_user.id != ADMIN_ID:
-        return await c.answer("Not allowed", show_alert=True)
+    async with req_lock(key):
+        if decided.get(key):
+            return await c.answer("Already handled", show_alert=True)
+        d = (await db.decide_requests(kind, [req_id], action == "ok", decision_text))[0]
+        if d["result"] != "not_found":
+            decided.set(key, True)
+    outbox.kick()
 
-    _, action, req_id = c.data.split(":")
-    ref = db.withdraws().document(req_id)
-    snap = ref.get()
-    if not snap.exists:
+    if d["result"] == "not_found":
         return await c.answer("Not found", show_alert=True)
-    d = snap.to_dict()
-
-    if d.get("status") != "pending":
+    if d["result"] == "skipped":
         return await c.answer("Already handled", show_alert=True)
+    if d.get("reason") == "insufficient_balance":
+        return await c.answer("Insufficient balance", show_alert=True)
+    if d["result"] == "approved":
+        return await c.answer("Approved ✅" if kind == "dep" else "Approved ✅ (deducted)", show_alert=True)
+    await c.answer("Rejected ❌", show_alert=True)
 
-    if action == "ok":
-        ok = db.deduct_balance(int(d["tg_id"]), float(d["amount"]))
-        if not ok:
-            ref.update({"status": "rejected", "rejected_at": db.now_iso(), "reason": "insufficient_balance"})
-            await bot.send_message(int(d["tg_id"]), "❌ Withdraw rejected (insufficient balance).")
-            return await c.answer("Insufficient balance", show_alert=True)
-
-        ref.update({"status": "approved", "approved_at": db.now_iso()})
-        await bot.send_message(
-            int(d["tg_id"]),
-            f"✅ Withdraw approved!\nAmount deducted: {float(d['amount']):.2f} BDT\nFee: {float(d['fee']):.2f} BDT\nPayable: {float(d['receive']):.2f} BDT"
-        )
-        await c.answer("Approved ✅ (deducted)", show_alert=True)
-    else:
-        ref.update({"status": "rejected", "rejected_at": db.now_iso()})
-        await bot.send_message(int(d["tg_id"]), "❌ Withdraw rejected.")
-        await c.answer("Rejected ❌", show_alert=True)
+@dp.callback_query(F.data.startswith("dep:"))
+async def deposit_approve_reject(c: CallbackQuery):
+    await decide(c, "dep")
+
+@dp.callback_query(F.data.startswith("wd:"))
+async def withdraw_approve_reject(c: CallbackQuery):
+    await decide(c, "wd")
 
 # ---------------- Admin reply in groups -> forward to user ----------------
 @dp.message(F.chat.id.in_({DEPOSIT_GROUP_ID, WITHDRAW_GROUP_ID}))
 async def admin_reply_forward(m: Message):
+    # only the admin's replies to the bot's own request posts matter; the
+    # rest of the group chatter never reaches storage
     if m.from_user.id != ADMIN_ID:
         return
-    if not m.reply_to_message:
+    reply = m.reply_to_message
+    if not reply or not reply.from_user or reply.from_user.id != m.bot.id:
         return
 
-    base = (m.reply_to_message.text or m.reply_to_message.caption or "")
-    req_id = None
-    if "`" in base:
-        parts = base.split("`")
-        if len(parts) >= 3:
-            req_id = parts[-2].strip()
-    if not req_id:
+    post = await db.get_group_post(m.chat.id, reply.message_id)
+    if not post:
         return
-
-    # decide which collection
-    col = db.deposits() if m.chat.id == DEPOSIT_GROUP_ID else db.withdraws()
-    ref = col.document(req_id)
-    snap = ref.get()
-    if not snap.exists:
+    req_id = post["req_id"]
+    is_dep = post["kind"] == "dep"
+    d = await (db.get_deposit(req_id) if is_dep else db.get_withdraw(req_id))
+    if not d:
         return
-    d = snap.to_dict()
     if d.get("admin_reply_sent"):
         return
 
     uid = int(d["tg_id"])
     try:
         if m.photo:
-            await bot.send_photo(uid, m.photo[-1].file_id, caption=m.caption or "✅ Admin message")
+            await m.bot.send_photo(uid, m.photo[-1].file_id, caption=m.caption or "✅ Admin message")
         elif m.document:
-            await bot.send_document(uid, m.document.file_id, caption=m.caption or "✅ Admin message")
+            await m.bot.send_document(uid, m.document.file_id, caption=m.caption or "✅ Admin message")
         else:
-            await bot.send_message(uid, m.text or (m.caption or "✅ Admin message"))
-        ref.update({"admin_reply_sent": True, "admin_reply_at": db.now_iso()})
+            await m.bot.send_message(uid, m.text or (m.caption or "✅ Admin message"))
+        update = db.update_deposit if is_dep else db.update_withdraw
+        await update(req_id, {"admin_reply_sent": True, "admin_reply_at": db.now_iso()})
     except:
         pass
 
 # ---------------- Products (site-like shop) ----------------
-def products_inline(items):
-    rows = []
-    for pid, p in items:
-        name = p.get("name", "Item")
-        price = p.get("price", 0)
-        stock = p.get("stock", 0)
-        rows.append([InlineKeyboardButton(text=f"🛒 Buy: {name} ({price} BDT) | Stock {stock}", callback_data=f"buy:{pid}")])
-    return InlineKeyboardMarkup(inline_keyboard=rows)
+async def shop_view(cat: int = None, page: int = 0):
+    # (text, keyboard) for a category list page (cat=None) or a product page;
+    # a shop with a single category opens straight on its products
+    cats = await catalog.categories()
+    if not cats:
+        return "📦 No products available yet.", None
+    if cat is None and len(cats) > 1:
+        per_page = SHOP_PAGE_SIZE * 2
+        pages = -(-len(cats) // per_page)
+        page = min(max(page, 0), pages - 1)
+        rows = [(i, name, n) for i, (name, n) in enumerate(cats)][page * per_page:(page + 1) * per_page]
+        return "🛒 Products — choose a category:", shop_categories(rows, page, pages)
+
+    pg = await catalog.shop_page(cat or 0, page)
+    lines = [f"🛒 {pg['category']} ({pg['page'] + 1}/{pg['pages']})\n"]
+    for pid, p in pg["items"]:
+        lines.append(f"• {p.get('name')} | {p.get('price')} BDT | Stock: {p.get('stock')}")
+    return "\n".join(lines), shop_page(pg)
 
 @dp.message(F.text == "🛒 Products")
 async def products_list(m: Message):
-    items = db.list_products()
-    if not items:
-        return await m.answer("📦 No products available yet.")
-    lines = ["🛒 Products:\n"]
-    for pid, p in items:
-        lines.append(f"• {p.get('name')} | {p.get('price')} BDT | Stock: {p.get('stock')}")
-    await m.answer("\n".join(lines))
-    await m.answer("👇 Tap to buy:", reply_markup=products_inline(items))
+    text, kb = await shop_view()
+    await m.answer(text, reply_markup=kb)
+
+@dp.callback_query(F.data.startswith("shop:"))
+async def shop_nav_cb(c: CallbackQuery):
+    parts = c.data.split(":")
+    try:
+        if parts[1] == "c":
+            text, kb = await shop_view(None, int(parts[2]))
+        else:
+            text, kb = await shop_view(int(parts[2]), int(parts[3]))
+    except (IndexError, ValueError):
+        return await c.answer()
+    try:
+        await c.message.edit_text(text, reply_markup=kb)
+    except:
+        pass
+    await c.answer()
+
+def purchase_text(res: dict) -> str:
+    return f"✅ Purchase successful!\n\n{res['delivery']}"
 
 @dp.callback_query(F.data.startswith("buy:"))
 async def buy(c: CallbackQuery):
     pid = c.data.split(":")[1]
-    p = db.get_product(pid)
+    p = await catalog.get_product(pid)
     if not p:
         return await c.answer("Not found", show_alert=True)
 
-    stock = int(p.get("stock", 0))
-    price = float(p.get("price", 0))
-
-    if stock <= 0:
+    # cheap reject from the cache; the transaction re-checks everything
+    if int(p.get("stock", 0)) <= 0:
         return await c.answer("Out of stock", show_alert=True)
 
-    bal = db.get_balance(c.from_user.id)
-    if bal < price:
-        return await c.answer("Insufficient balance", show_alert=True)
-
-    ok = db.deduct_balance(c.from_user.id, price)
-    if not ok:
+    res = await db.purchase(c.from_user.id, pid, purchase_text)
+    catalog.on_purchase(pid, res)
+    if res["status"] == "not_found":
+        catalog.invalidate()
+        return await c.answer("Not found", show_alert=True)
+    if res["status"] == "out_of_stock":
+        return await c.answer("Out of stock", show_alert=True)
+    if res["status"] == "insufficient_balance":
         return await c.answer("Insufficient balance", show_alert=True)
 
-    db.update_product(pid, {"stock": stock - 1})
-
-    delivery = p.get("delivery", "✅ Delivered!")
-    await bot.send_message(c.from_user.id, f"✅ Purchase successful!\n\n{delivery}")
+    outbox.kick()
     await c.answer("Purchased ✅", show_alert=True)
 
 # ---------------- Admin Panel ----------------
@@ -462,19 +545,191 @@ async def admin_panel_open(m: Message, state: FSMContext):
 async def admin_total_users(m: Message):
     if not is_admin(m.from_user.id):
         return
-    total = db.count_users()
-    await m.answer(f"👥 Total Users: {total}")
+    st = await db.user_stats()
+    await m.answer(
+        f"👥 Total Users: {st['total']}\n"
+        f"🆕 New today: {st['new_users']}\n"
+        f"🔥 Active today: {st['active_users']}\n"
+        f"📅 {st['day']} (UTC)"
+    )
+
+@dp.message(F.text == "📈 Stats")
+async def admin_stats(m: Message):
+    if not is_admin(m.from_user.id):
+        return
+    caches = db.cache_stats()
+    lines = [metrics.summary(), "\nCaches:"]
+    for name, st in caches.items():
+        total = st["hits"] + st["misses"]
+        rate = f"{st['hits'] * 100 / total:.0f}%" if total else "-"
+        lines.append(f"• {name}: {st['size']} items, hit {rate}")
+    lines.append(f"\n📬 Outbox backlog: {await db.outbox_backlog()}")
+    t = throttle.stats()
+    lines.append(f"🚦 Throttled: {t['throttled']} | Coalesced: {t['coalesced']} | Tracked users: {t['users']}")
+    await m.answer("\n".join(lines))
+
+def finance_lines(f: dict) -> list:
+    n = lambda k: int(f.get(k, 0))
+    amt = lambda k: f"{float(f.get(k, 0)):.2f}"
+    return [
+        f"➕ Deposits approved: {n('deposits_approved')} · {amt('deposits_approved_amount')} BDT"
+        f" (rejected {n('deposits_rejected')})",
+        f"🏧 Withdraws approved: {n('withdraws_approved')} · {amt('withdraws_approved_amount')} BDT"
+        f" (rejected {n('withdraws_rejected')})",
+        f"💸 Withdraw fees: {amt('withdraw_fees')} BDT",
+        f"🛒 Sales: {n('sales')} · {amt('sales_amount')} BDT",
+    ]
+
+@dp.message(F.text == "📊 Report")
+async def admin_report(m: Message):
+    if not is_admin(m.from_user.id):
+        return
+    r = await db.finance_report()
+    total = r["total"]
+    lines = [f"📊 Report — {r['day']} (UTC)\n", "Today:", *finance_lines(r["today"]), "\nAll time:", *finance_lines(total)]
+    lines += [
+        f"⏳ Pending deposits: {int(total.get('deposits_pending', 0))} · {float(total.get('deposits_pending_amount', 0)):.2f} BDT",
+        f"⏳ Pending withdraws: {int(total.get('withdraws_pending', 0))} · {float(total.get('withdraws_pending_amount', 0)):.2f} BDT",
+        f"💰 User balances (owed): {float(total.get('balances', 0)):.2f} BDT",
+    ]
+    top = sorted((total.get("products") or {}).values(), key=lambda p: -float(p.get("amount", 0)))[:10]
+    if top:
+        lines.append("\nTop products:")
+        lines += [f"• {p.get('name')} — {int(p.get('sales', 0))} sold · {float(p.get('amount', 0)):.2f} BDT" for p in top]
+    if not total.get("seeded"):
+        lines.append("\n⚠️ Totals not seeded from existing data yet: run /finance_rebuild fix")
+    await m.answer("\n".join(lines))
+
+@dp.message(Command("finance_rebuild"))
+async def admin_finance_rebuild(m: Message, command: CommandObject):
+    # /finance_rebuild [fix]: recompute the report from raw data, show drift
+    if not is_admin(m.from_user.id):
+        return
+    fix = (command.args or "").strip().lower() == "fix"
+    await m.answer("🧮 Rebuilding finance totals...")
+    r = await db.rebuild_finance(fix)
+    lines = [f"🧮 Scanned {r['scanned']} docs, {r['days']} days", f"Drift: {len(r['drift'])} field(s)"]
+    for doc_id, field, stored, actual in r["drift"][:20]:
+        lines.append(f"• {doc_id} {field}: {stored:g} → {actual:g}")
+    if len(r["drift"]) > 20:
+        lines.append(f"… {len(r['drift']) - 20} more")
+    if fix:
+        lines.append(f"✅ Fixed {r['fixed']} doc(s)")
+    elif r["drift"]:
+        lines.append("Run /finance_rebuild fix to overwrite them.")
+    await m.answer("\n".join(lines))
+
+# Pending queue: page through pending requests, tick several, approve or
+# reject them in one go (chunked transactions, see db.decide_requests)
+async def pending_view(kind: str, cursor: str = None, direction: str = "next"):
+    rows, more = await db.pending_page(kind, cursor, direction, PENDING_PAGE_SIZE)
+    title = "📥 Pending deposits" if kind == "dep" else "📥 Pending withdraws"
+    if not rows:
+        return f"{title}\n\n• None", pending_queue(kind, [])
+
+    lines = [f"{title}\n"]
+    for d in rows:
+        when = (d.get("created_at") or "")[:16].replace("T", " ")
+        ref = f"TxID {d.get('txid')}" if kind == "dep" else f"To {d.get('address')}"
+        flag = "⚠️ " if d.get("dup_txid") or d.get("dup_photo") else ""
+        lines.append(
+            f"• {flag}{float(d.get('amount', 0)):.2f} BDT | {d.get('method', '').upper()} | "
+            f"User {d.get('tg_id')} | {ref} | {when}"
+        )
+
+    has_newer = more if direction == "next" else bool(cursor)
+    has_older = bool(cursor) if direction == "next" else more
+    kb = pending_queue(
+        kind, rows,
+        rows[0]["created_at"] if has_older else None,
+        rows[-1]["created_at"] if has_newer else None,
+    )
+    return "\n".join(lines), kb
+
+@dp.message(F.text == "📥 Pending")
+async def admin_pending(m: Message):
+    if not is_admin(m.from_user.id):
+        return
+    text, kb = await pending_view("dep")
+    await m.answer(text, reply_markup=kb)
+
+@dp.callback_query(F.data.startswith("pq:"))
+async def pending_cb(c: CallbackQuery):
+    if not is_admin(c.from_user.id):
+        return await c.answer("Not allowed", show_alert=True)
+
+    if not c.message or not c.message.reply_markup:
+        return await c.answer()
+    # created_at cursors contain ':' so split at most 3 times
+    parts = c.data.split(":", 3)
+    action, kind = parts[1], parts[2]
+    arg = parts[3] if len(parts) > 3 else None
+
+    if action in ("t", "a"):
+        try:
+            await c.message.edit_reply_markup(reply_markup=toggle_pending(c.message.reply_markup, arg))
+        except:
+            pass
+        return await c.answer()
+
+    if action in ("v", "n", "p"):
+        text, kb = await pending_view(kind, arg, "prev" if action == "p" else "next")
+        try:
+            await c.message.edit_text(text, reply_markup=kb)
+        except:
+            pass
+        return await c.answer()
+
+    if seen_callback(c):
+        return
+    req_ids = selected_pending(c.message.reply_markup)
+    if not req_ids:
+        return await c.answer("Nothing selected", show_alert=True)
+
+    results = await db.decide_requests(kind, req_ids, action == "ok", decision_text)
+    outbox.kick()
+    for d in results:
+        if d["result"] != "not_found":
+            decided.set(f"{kind}:{d['req_id']}", True)
+    approved = sum(1 for d in results if d["result"] == "approved")
+    rejected = sum(1 for d in results if d["result"] == "rejected")
+    skipped = len(results) - approved - rejected
+    await c.answer(f"✅ {approved} approved | ❌ {rejected} rejected | ⏭ {skipped} skipped", show_alert=True)
+
+    text, kb = await pending_view(kind)
+    try:
+        await c.message.edit_text(text, reply_markup=kb)
+    except:
+        pass
+
+@dp.message(Command("reconcile"))
+async def admin_reconcile(m: Message, command: CommandObject):
+    # /reconcile <tg_id>: balance field vs. ledger sum
+    if not is_admin(m.from_user.id):
+        return
+    try:
+        uid = int((command.args or "").strip())
+    except ValueError:
+        return await m.answer("Usage: /reconcile <user_id>")
+    r = await db.reconcile_balance(uid)
+    status = "✅ OK" if abs(r["diff"]) < 0.01 else "⚠️ Mismatch"
+    await m.answer(
+        f"🧮 Reconcile `{uid}`\n\n"
+        f"Balance: {r['balance']:.2f}\nLedger: {r['ledger']:.2f} ({r['entries']} entries)\n"
+        f"Diff: {r['diff']:.2f}\n{status}",
+        parse_mode="Markdown",
+    )
 
 @dp.message(F.text == "📦 Products")
 async def admin_products(m: Message):
     if not is_admin(m.from_user.id):
         return
-    items = db.list_products()
+    items = await catalog.list_products()
     if not items:
         return await m.answer("No products yet.")
     lines = ["📦 Products:\n"]
     for pid, p in items:
-        lines.append(f"ID: {pid}\n• {p.get('name')} | Price {p.get('price')} | Stock {p.get('stock')}\n")
+        lines.append(f"ID: {pid}\n• {p.get('name')} | Price {p.get('price')} | Stock {p.get('stock')} | Shards {p.get('shards') or 1} | {p.get('category') or catalog.DEFAULT_CATEGORY}\n")
     await m.answer("\n".join(lines))
 
 @dp.message(F.text == "➕ Add Product")
@@ -488,6 +743,13 @@ async def admin_add_product(m: Message, state: FSMContext):
 @dp.message(AdminAddProduct.name)
 async def prod_name(m: Message, state: FSMContext):
     await state.update_data(name=m.text.strip())
+    await m.answer("🗂 Category লিখো (যেমন Netflix, Games) অথবা - লিখো:")
+    await state.set_state(AdminAddProduct.category)
+
+@dp.message(AdminAddProduct.category)
+async def prod_category(m: Message, state: FSMContext):
+    category = m.text.strip()
+    await state.update_data(category="" if category == "-" else category)
     await m.answer("💵 Price (BDT) লিখো:")
     await state.set_state(AdminAddProduct.price)
 
@@ -499,11 +761,18 @@ async def prod_price(m: Message, state: FSMContext):
     except:
         return await m.answer("❌ Invalid price. Example: 250")
     await state.update_data(price=price)
-    await m.answer("📦 Stock / কতো জন পাবে লিখো (number):")
+    await m.answer(
+        "📦 Stock / কতো জন পাবে লিখো (number)\n"
+        "অথবা unique codes/accounts-এর CSV/TXT file পাঠাও (এক লাইনে একটা, header ছাড়া) - stock = code সংখ্যা:"
+    )
     await state.set_state(AdminAddProduct.stock)
 
 @dp.message(AdminAddProduct.stock)
 async def prod_stock(m: Message, state: FSMContext):
+    if m.document:
+        await state.update_data(stock=0, codes_file=m.document.file_id, codes_name=m.document.file_name)
+        await m.answer("📩 Delivery text (প্রতিটা code-এর উপরে যাবে, না চাইলে - লিখো):")
+        return await state.set_state(AdminAddProduct.delivery)
     try:
         stock = int(m.text.strip())
         if stock < 0: raise ValueError
@@ -513,12 +782,80 @@ async def prod_stock(m: Message, state: FSMContext):
     await m.answer("📩 Delivery text (যা user পাবে) লিখো:")
     await state.set_state(AdminAddProduct.delivery)
 
+async def read_codes(bot: Bot, file_id: str, file_name: str) -> list:
+    # TXT: one item per line. CSV: one item per row, cells joined with " | "
+    text = (await bot.download(file_id)).getvalue().decode("utf-8-sig", errors="replace")
+    if (file_name or "").lower().endswith(".csv"):
+        return [" | ".join(c.strip() for c in row if c.strip()) for row in csv.reader(io.StringIO(text))]
+    return [line.strip() for line in text.splitlines()]
+
+def codes_report(res: dict) -> str:
+    skipped = f" ({res['skipped']} already in pool, skipped)" if res["skipped"] else ""
+    return f"🔑 Codes added: {res['added']}{skipped}"
+
 @dp.message(AdminAddProduct.delivery)
 async def prod_delivery(m: Message, state: FSMContext):
     data = await state.get_data()
-    pid = db.create_product(data["name"], float(data["price"]), int(data["stock"]), m.text)
+    if not data.get("codes_file"):
+        pid = await catalog.create_product(
+            data["name"], float(data["price"]), int(data["stock"]), m.text, category=data.get("category", ""),
+        )
+        await state.clear()
+        return await m.answer(f"✅ Product added!\nID: {pid}", reply_markup=admin_panel())
+
+    delivery = "" if m.text.strip() == "-" else m.text
+    items = await read_codes(m.bot, data["codes_file"], data.get("codes_name"))
+    pid = await catalog.create_product(
+        data["name"], float(data["price"]), 0, delivery, pool=True, category=data.get("category", ""),
+    )
+    res = await catalog.add_codes(pid, items)
     await state.clear()
-    await m.answer(f"✅ Product added!\nID: {pid}", reply_markup=admin_panel())
+    await m.answer(f"✅ Product added!\nID: {pid}\n{codes_report(res)}", reply_markup=admin_panel())
+
+@dp.message(Command("codes"), F.document)
+async def admin_add_codes(m: Message, command: CommandObject):
+    # file with caption /codes <product_id>: top up a code-pool product
+    if not is_admin(m.from_user.id):
+        return
+    pid = (command.args or "").strip()
+    p = await catalog.get_product(pid) if pid else None
+    if not p or not p.get("pool"):
+        return await m.answer("Usage: send a CSV/TXT file with caption /codes <product_id> (code-pool products only)")
+    items = await read_codes(m.bot, m.document.file_id, m.document.file_name)
+    res = await catalog.add_codes(pid, items)
+    await m.answer(f"✅ {p.get('name')}\n{codes_report(res)}")
+
+@dp.message(Command("category"))
+async def admin_set_category(m: Message, command: CommandObject):
+    # /category <product_id> <name>: move a product to another shop category
+    if not is_admin(m.from_user.id):
+        return
+    pid, _, category = (command.args or "").strip().partition(" ")
+    p = await catalog.get_product(pid) if pid else None
+    if not p or not category.strip():
+        return await m.answer("Usage: /category <product_id> <category>")
+    await catalog.update_product(pid, {"category": category.strip()})
+    await m.answer(f"✅ {p.get('name')} → {category.strip()}")
+
+@dp.message(Command("shards"))
+async def admin_set_shards(m: Message, command: CommandObject):
+    # /shards <product_id> <n>: spread a hot product's stock over n shard docs (1 = off)
+    if not is_admin(m.from_user.id):
+        return
+    try:
+        pid, n = (command.args or "").split()
+        n = int(n)
+        if not 1 <= n <= 100: raise ValueError
+    except ValueError:
+        return await m.answer("Usage: /shards <product_id> <1-100>")
+    p = await catalog.get_product(pid)
+    if not p or p.get("pool"):
+        return await m.answer("❌ Product not found (code-pool products can't be sharded)")
+    try:
+        await catalog.reshard_product(pid, n)
+    except Exception as e:
+        return await m.answer(f"❌ Reshard failed: {e}")
+    await m.answer(f"✅ {p.get('name')}: stock in {n} shard(s)")
 
 @dp.message(F.text == "📢 Broadcast")
 async def broadcast_start(m: Message, state: FSMContext):
@@ -533,32 +870,59 @@ async def broadcast_send(m: Message, state: FSMContext):
     if not is_admin(m.from_user.id):
         return
 
-    # collect user ids
-    user_ids = []
-    for s in db.users().stream():
-        user_ids.append(int(s.to_dict().get("tg_id")))
-
-    sent = 0
-    for uid in user_ids:
-        try:
-            if m.photo:
-                await bot.send_photo(uid, m.photo[-1].file_id, caption=m.caption or "")
-            elif m.document:
-                await bot.send_document(uid, m.document.file_id, caption=m.caption or "")
-            else:
-                await bot.send_message(uid, m.text or "")
-            sent += 1
-        except:
-            continue
-
+    await broadcast.start(m.bot, m.from_user.id, m.chat.id, m.message_id)
     await state.clear()
-    await m.answer(f"✅ Broadcast done: {sent}/{len(user_ids)}", reply_markup=admin_panel())
+    await m.answer("📢 Broadcast started. Progress will update above.", reply_markup=admin_panel())
 
 # ---------------- Runner ----------------
-async def main():
+_runners = []
+_warm = {"task": None}
+
+async def warm_up():
+    # fill the caches the first requests would otherwise pay for; handlers
+    # load lazily too, so updates are served while this runs
+    await asyncio.gather(catalog.start(), db.count_users(), media.banner_photo(), return_exceptions=True)
+
+async def on_startup(bot: Bot):
+    # connect storage up front instead of on the first update
+    await db.init()
+    if METRICS_PORT:
+        _runners.append(await metrics.serve(METRICS_HOST, METRICS_PORT))
+    _warm["task"] = asyncio.create_task(warm_up())
+    # every worker drains the outbox (claims are transactional)
+    outbox.start(bot)
+    # with several webhook workers only the first one resumes broadcasts
+    if WORKER_INDEX == 0:
+        await broadcast.resume_all(bot)
+
+async def on_shutdown(bot: Bot):
+    if _warm["task"]:
+        _warm["task"].cancel()
+    catalog.stop()
+    outbox.stop()
+    for runner in _runners:
+        await runner.cleanup()
+    db.shutdown()
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+def check_token():
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN missing. Put it in .env")
+
+async def main():
+    check_token()
+    bot = create_bot()
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
-if __name__ == "__main__":
+def run():
+    if RUN_MODE == "webhook":
+        from .webhook import run_webhook
+        check_token()
+        return run_webhook(dp, create_bot())
     asyncio.run(main())
+
+if __name__ == "__main__":
+    run()
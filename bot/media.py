@@ -0,0 +1,54 @@
+# Banner image: uploaded from BANNER_IMAGE_URL once, then reused by file_id.
+# The file_id is persisted (keyed by URL) so restarts don't re-upload it.
+import asyncio
+
+from aiogram import Bot
+from aiogram.types import Message, URLInputFile, InputMediaPhoto
+
+from .config import BANNER_IMAGE_URL
+from . import storage as db
+
+_banner = {"loaded": False, "file_id": None}
+_load_lock = asyncio.Lock()
+
+async def banner_photo():
+    if not _banner["loaded"]:
+        async with _load_lock:
+            if not _banner["loaded"]:
+                saved = await db.get_setting("banner") or {}
+                if saved.get("url") == BANNER_IMAGE_URL:
+                    _banner["file_id"] = saved.get("file_id")
+                _banner["loaded"] = True
+    return _banner["file_id"] or URLInputFile(BANNER_IMAGE_URL)
+
+async def remember_banner(msg: Message):
+    if _banner["file_id"] or not msg.photo:
+        return
+    _banner["file_id"] = msg.photo[-1].file_id
+    await db.set_setting("banner", {"url": BANNER_IMAGE_URL, "file_id": _banner["file_id"]})
+
+def forget_banner():
+    # cached file_id was rejected; next send uploads from the URL again
+    _banner["file_id"] = None
+
+async def send_banner(bot: Bot, chat_id: int, caption: str, **kwargs) -> Message:
+    try:
+        msg = await bot.send_photo(chat_id, await banner_photo(), caption=caption, **kwargs)
+    except Exception:
+        forget_banner()
+        raise
+    await remember_banner(msg)
+    return msg
+
+async def send_banner_album(bot: Bot, chat_id: int, caption: str, photo_file_id: str, photo_caption: str, **kwargs) -> list:
+    # banner + user's photo as one album; caption goes on the banner
+    try:
+        msgs = await bot.send_media_group(chat_id, [
+            InputMediaPhoto(media=await banner_photo(), caption=caption, **kwargs),
+            InputMediaPhoto(media=photo_file_id, caption=photo_caption, **kwargs),
+        ])
+    except Exception:
+        forget_banner()
+        raise
+    await remember_banner(msgs[0])
+    return msgs
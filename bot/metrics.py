@@ -0,0 +1,149 @@
+# Process-local counters and latency histograms, exported in Prometheus
+# text format on a local /metrics endpoint and summarised for the admin.
+import threading
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "handler_seconds": "Handler latency",
+    "storage_seconds": "Storage (firebase_db) call latency",
+    "telegram_seconds": "Outgoing Bot API call latency",
+}
+
+_lock = threading.Lock()
+_hist = {}      # (name, label_value, status) -> [bucket counts..., +Inf], sum, count
+_counters = {}  # name -> count
+_started = time.time()
+
+def _label(name: str) -> str:
+    return {"handler_seconds": "handler", "storage_seconds": "fn", "telegram_seconds": "method"}[name]
+
+def observe(name: str, key: str, seconds: float, ok: bool = True):
+    status = "ok" if ok else "error"
+    with _lock:
+        h = _hist.get((name, key, status))
+        if h is None:
+            h = _hist[(name, key, status)] = {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0}
+        for i, b in enumerate(BUCKETS):
+            if seconds <= b:
+                h["buckets"][i] += 1
+                break
+        else:
+            h["buckets"][-1] += 1
+        h["sum"] += seconds
+        h["count"] += 1
+
+def incr(name: str, n: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+class timed:
+    # with timed("storage_seconds", fn.__name__): ...
+    def __init__(self, name: str, key: str):
+        self.name = name
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, self.key, time.perf_counter() - self.start, exc_type is None)
+        return False
+
+def render() -> str:
+    with _lock:
+        items = sorted((k, {**v, "buckets": list(v["buckets"])}) for k, v in _hist.items())
+        counters = sorted(_counters.items())
+    out = []
+    done = set()
+    for (name, key, status), h in items:
+        if name not in done:
+            done.add(name)
+            out.append(f"# HELP dxa_{name} {HELP.get(name, name)}")
+            out.append(f"# TYPE dxa_{name} histogram")
+        labels = f'{_label(name)}="{key}",status="{status}"'
+        cum = 0
+        for b, n in zip(BUCKETS, h["buckets"]):
+            cum += n
+            out.append(f'dxa_{name}_bucket{{{labels},le="{b}"}} {cum}')
+        out.append(f'dxa_{name}_bucket{{{labels},le="+Inf"}} {h["count"]}')
+        out.append(f"dxa_{name}_sum{{{labels}}} {h['sum']:.6f}")
+        out.append(f"dxa_{name}_count{{{labels}}} {h['count']}")
+    for name, value in counters:
+        out.append(f"# TYPE dxa_{name}_total counter")
+        out.append(f"dxa_{name}_total {value}")
+    out.append("# TYPE dxa_uptime_seconds gauge")
+    out.append(f"dxa_uptime_seconds {time.time() - _started:.0f}")
+    return "\n".join(out) + "\n"
+
+def _p95(buckets: list, count: int) -> float:
+    need, cum = count * 0.95, 0
+    for b, n in zip(BUCKETS, buckets):
+        cum += n
+        if cum >= need:
+            return b
+    return float("inf")
+
+def top(name: str, limit: int = 8) -> list:
+    # [(key, count, errors, avg_s, p95_s, total_s)] by total time spent
+    with _lock:
+        merged = {}
+        for (n, key, status), h in _hist.items():
+            if n != name:
+                continue
+            m = merged.setdefault(key, {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0, "errors": 0})
+            m["buckets"] = [a + b for a, b in zip(m["buckets"], h["buckets"])]
+            m["sum"] += h["sum"]
+            m["count"] += h["count"]
+            if status == "error":
+                m["errors"] += h["count"]
+    rows = [
+        (key, m["count"], m["errors"], m["sum"] / m["count"], _p95(m["buckets"], m["count"]), m["sum"])
+        for key, m in merged.items() if m["count"]
+    ]
+    rows.sort(key=lambda r: r[5], reverse=True)
+    return rows[:limit]
+
+def summary() -> str:
+    lines = [f"📈 Stats (uptime {int((time.time() - _started) // 60)} min)"]
+    for name, title in (("handler_seconds", "Handlers"), ("storage_seconds", "Storage"), ("telegram_seconds", "Bot API")):
+        lines.append(f"\n{title}:")
+        rows = top(name)
+        if not rows:
+            lines.append("• None")
+        for key, count, errors, avg, p95, _ in rows:
+            err = f" ❗{errors}" if errors else ""
+            lines.append(f"• {key}: {count}x avg {avg * 1000:.0f}ms p95≤{p95 * 1000:.0f}ms{err}")
+    return "\n".join(lines)
+
+# -- aiogram hooks --
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # inner middleware: only runs for updates that matched a handler
+    async def __call__(self, handler, event, data):
+        h = data.get("handler")
+        name = getattr(getattr(h, "callback", None), "__name__", "unknown")
+        with timed("handler_seconds", name):
+            return await handler(event, data)
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        with timed("telegram_seconds", method.__api_method__):
+            return await make_request(bot, method)
+
+# -- /metrics endpoint --
+async def _metrics(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+async def serve(host: str, port: int):
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
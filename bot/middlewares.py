@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+from .config import (
+    ADMIN_ID, THROTTLE_RATE, THROTTLE_BURST, THROTTLE_GLOBAL_RATE, THROTTLE_IDLE_SEC,
+)
+from .ratelimit import TokenBucket
+from . import storage as db
+from . import metrics
+
+class ActivityMiddleware(BaseMiddleware):
+    # Marks private-chat users active for the day. Each user costs one
+    # storage call per day per process; it runs off the update's path.
+    def __init__(self):
+        self.day = None
+        self.seen = set()
+        self.tasks = set()
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        if user and (chat is None or chat.type == "private"):
+            day = db.today()
+            if day != self.day:
+                self.day, self.seen = day, set()
+            if user.id not in self.seen:
+                self.seen.add(user.id)
+                task = asyncio.create_task(db.touch_user(user.id))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+        return await handler(event, data)
+
+# Callbacks that must always go through (admin decisions in the groups)
+EXEMPT_CALLBACKS = ("dep:", "wd:", "pq:")
+# Read-only views: a repeat that arrives while the same view is still being
+# rendered waits for it and shares its result instead of running again
+COALESCE_TEXTS = ("💰 Wallet", "🛒 Products", "🧾 History")
+COALESCE_CALLBACKS = ("shop:", "hist:")
+# Purchases: a repeat tap while the first one is still running is refused
+INFLIGHT_CALLBACKS = ("buy:",)
+SWEEP_EVERY = 1024
+SLOW_DOWN = "⏳ Too many requests, please slow down."
+ALREADY_PROCESSING = "⏳ Already processing this purchase..."
+
+def _flight_key(event, uid: int):
+    # (key, shared): views are shared with a repeat, purchases are not.
+    # Callbacks are keyed per message so paging another message isn't merged.
+    if isinstance(event, CallbackQuery):
+        data = event.data or ""
+        msg_id = event.message.message_id if event.message else None
+        if data.startswith(COALESCE_CALLBACKS):
+            return (uid, msg_id, data), True
+        if data.startswith(INFLIGHT_CALLBACKS):
+            return (uid, data), False
+    elif isinstance(event, Message) and event.text in COALESCE_TEXTS:
+        return (uid, event.text), True
+    return None, False
+
+class ThrottleMiddleware(BaseMiddleware):
+    # Anti-flood for private-chat messages and callbacks, registered as an outer
+    # middleware so dropped updates never reach filters or storage.
+    # - the same read-only view (COALESCE_TEXTS / COALESCE_CALLBACKS, per
+    #   message for callbacks) asked for again while the first request is
+    #   still running is coalesced into it; once it's done, a repeat runs
+    # - a buy tap repeated while that purchase is still running gets
+    #   "already processing"; anything else (FSM input included) is never
+    #   coalesced, only rate limited
+    # - each user spends a token (THROTTLE_RATE/s, bursts of THROTTLE_BURST)
+    #   and the bot one of THROTTLE_GLOBAL_RATE/s; the user's token is only
+    #   spent once the global bucket has let the update through
+    # State is [tokens, last_seen, warned] per user plus the running keys;
+    # idle users are swept every SWEEP_EVERY updates.
+    def __init__(self):
+        self.users = {}
+        self.inflight = {}
+        self.bucket = TokenBucket(THROTTLE_GLOBAL_RATE)
+        self.calls = 0
+        self.throttled = 0
+        self.coalesced = 0
+
+    def stats(self) -> dict:
+        return {"throttled": self.throttled, "coalesced": self.coalesced, "users": len(self.users)}
+
+    def _sweep(self, now: float):
+        self.users = {u: e for u, e in self.users.items() if now - e[1] < THROTTLE_IDLE_SEC}
+
+    def _allow(self, uid: int, now: float) -> bool:
+        e = self.users.get(uid)
+        if e is None:
+            e = self.users[uid] = [float(THROTTLE_BURST), now, False]
+        e[0] = min(float(THROTTLE_BURST), e[0] + (now - e[1]) * THROTTLE_RATE)
+        e[1] = now
+        if e[0] < 1 or not self.bucket.try_take():
+            return False
+        e[0] -= 1
+        e[2] = False
+        return True
+
+    async def _reject(self, event, uid: int):
+        self.throttled += 1
+        metrics.incr("throttled")
+        e = self.users[uid]
+        warn = not e[2]
+        e[2] = True
+        # tell the user once per throttled spell, then drop quietly
+        if isinstance(event, CallbackQuery):
+            await event.answer(SLOW_DOWN if warn else None)
+        elif warn and isinstance(event, Message):
+            await event.answer(SLOW_DOWN)
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        # only private chats: the admin groups are never throttled or warned
+        if user is None or user.id == ADMIN_ID or (chat is not None and chat.type != "private"):
+            return await handler(event, data)
+        if isinstance(event, CallbackQuery) and (event.data or "").startswith(EXEMPT_CALLBACKS):
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self.calls += 1
+        if self.calls % SWEEP_EVERY == 0:
+            self._sweep(now)
+
+        key, shared = _flight_key(event, user.id)
+        if key in self.inflight:
+            if not shared:
+                return await event.answer(ALREADY_PROCESSING)
+            self.coalesced += 1
+            metrics.incr("coalesced")
+            # shield: a cancelled waiter must not cancel the shared result
+            result = await asyncio.shield(self.inflight[key])
+            if isinstance(event, CallbackQuery):
+                await event.answer()
+            return result
+
+        if not self._allow(user.id, now):
+            return await self._reject(event, user.id)
+        if key is None:
+            return await handler(event, data)
+        done = self.inflight[key] = asyncio.get_running_loop().create_future()
+        result = None
+        try:
+            result = await handler(event, data)
+            return result
+        finally:
+            del self.inflight[key]
+            done.set_result(result)
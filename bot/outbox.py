@@ -0,0 +1,99 @@
+# Outbox sender: delivers the notifications that handlers queue inside their
+# transactions (db.decide_requests / db.purchase). Claims a batch, sends it
+# concurrently under the shared Telegram rate limit and deletes each message
+# once sent, or retries it with backoff, or marks it failed (pruned after
+# OUTBOX_KEEP_FAILED_DAYS).
+#
+# Delivery is exactly once unless the process dies between Telegram
+# accepting a message and it being deleted; the lease then expires and
+# that one message goes out again.
+import asyncio
+import logging
+import random
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from .config import (
+    OUTBOX_CONCURRENCY, OUTBOX_BATCH, OUTBOX_POLL_SEC, OUTBOX_LEASE_SEC, OUTBOX_MAX_ATTEMPTS,
+)
+from .broadcast import limiter
+from . import storage as db
+from . import metrics
+
+MAX_BACKOFF_SEC = 300
+PRUNE_EVERY_SEC = 3600
+
+log = logging.getLogger(__name__)
+
+_state = {"task": None}
+_wake = asyncio.Event()
+
+def kick():
+    # something was just queued: don't wait for the next poll
+    _wake.set()
+
+def start(bot: Bot):
+    if _state["task"] is None:
+        _state["task"] = asyncio.create_task(_run(bot))
+
+def stop():
+    task, _state["task"] = _state["task"], None
+    if task:
+        task.cancel()
+
+def backoff(attempts: int) -> float:
+    return min(MAX_BACKOFF_SEC, 2 ** attempts) * random.uniform(0.5, 1.0)
+
+async def _retry(m: dict, delay: float, error: str):
+    await db.outbox_retry(m["msg_id"], delay, error)
+    # wake up when it's due rather than at the next poll
+    asyncio.get_running_loop().call_later(delay, _wake.set)
+
+async def _run(bot: Bot):
+    sem = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+    failures, pruned_at = 0, 0.0
+    while True:
+        _wake.clear()
+        try:
+            batch = await db.outbox_claim(OUTBOX_BATCH, OUTBOX_LEASE_SEC)
+            failures = 0
+        except Exception:
+            # e.g. the Firestore index is missing: say so, don't spin
+            failures += 1
+            delay = backoff(failures)
+            metrics.incr("outbox_claim_errors")
+            log.exception("outbox claim failed (%d in a row), retrying in %.0fs", failures, delay)
+            await asyncio.sleep(delay)
+            continue
+        if not batch:
+            if time.monotonic() - pruned_at >= PRUNE_EVERY_SEC:
+                pruned_at = time.monotonic()
+                try:
+                    await db.outbox_prune()
+                except Exception:
+                    log.exception("outbox prune failed")
+            # sleep until kick() or the next poll
+            timer = asyncio.get_running_loop().call_later(OUTBOX_POLL_SEC, _wake.set)
+            await _wake.wait()
+            timer.cancel()
+            continue
+        await asyncio.gather(*(_deliver(bot, m, sem) for m in batch), return_exceptions=True)
+
+async def _deliver(bot: Bot, m: dict, sem: asyncio.Semaphore):
+    async with sem:
+        await limiter.wait(m["chat_id"])
+        try:
+            await bot.send_message(m["chat_id"], m["text"])
+        except TelegramRetryAfter as e:
+            limiter.pause(e.retry_after)
+            return await _retry(m, e.retry_after, "retry_after")
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # blocked / chat gone / bad text: retrying won't help
+            return await db.outbox_done(m["msg_id"], "failed", str(e))
+        except Exception as e:
+            if m["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                return await db.outbox_done(m["msg_id"], "failed", str(e))
+            return await _retry(m, backoff(m["attempts"]), str(e))
+        await db.outbox_done(m["msg_id"])
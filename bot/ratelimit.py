@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+class TokenBucket:
+    # rate tokens/second, bursts up to capacity
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, n: float = 1) -> bool:
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    async def take(self, n: float = 1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep((n - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        # Telegram said RetryAfter: nobody sends until it's over
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+class ChatLimiter:
+    # Global bucket + minimum gap between messages to the same chat
+    def __init__(self, global_rate: float, per_chat_interval: float):
+        self.bucket = TokenBucket(global_rate)
+        self.interval = per_chat_interval
+        self._next = {}
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        at = self._next.get(chat_id, 0.0)
+        self._next[chat_id] = max(at, now) + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+        await self.bucket.take()
+        if len(self._next) > 10000:
+            now = time.monotonic()
+            self._next = {k: v for k, v in self._next.items() if v > now}
+
+    def pause(self, seconds: float):
+        self.bucket.pause(seconds)
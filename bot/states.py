@@ -14,6 +14,7 @@ class WithdrawFlow(StatesGroup):
 
 class AdminAddProduct(StatesGroup):
     name = State()
+    category = State()
     price = State()
     stock = State()
     delivery = State()
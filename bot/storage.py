@@ -0,0 +1,168 @@
+# Async facade over firebase_db: the Firestore client is blocking, so every
+# call runs on a bounded thread pool instead of inside the event loop.
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .config import DB_POOL_SIZE
+from . import firebase_db as _db
+from . import metrics
+
+_pool = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+now_iso = _db.now_iso
+today = _db.today
+
+def _timed(fn, *args, **kwargs):
+    with metrics.timed("storage_seconds", fn.__name__):
+        return fn(*args, **kwargs)
+
+async def run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool, partial(_timed, fn, *args, **kwargs))
+
+async def init():
+    # explicit startup hook: connect now rather than on the first call
+    await run(_db.init)
+
+def shutdown():
+    _pool.shutdown(wait=True)
+
+# Settings
+async def get_setting(key: str):
+    return await run(_db.get_setting, key)
+
+async def set_setting(key: str, value: dict):
+    return await run(_db.set_setting, key, value)
+
+# Users
+async def ensure_user(tg_id: int, name: str) -> bool:
+    return await run(_db.ensure_user, tg_id, name)
+
+async def touch_user(tg_id: int) -> bool:
+    return await run(_db.touch_user, tg_id)
+
+async def get_balance(tg_id: int) -> float:
+    return await run(_db.get_balance, tg_id)
+
+async def add_balance(tg_id: int, amount: float, kind: str = "admin", ref: str = None, note: str = None):
+    return await run(_db.add_balance, tg_id, amount, kind, ref, note)
+
+async def deduct_balance(tg_id: int, amount: float, kind: str = "admin", ref: str = None, note: str = None) -> bool:
+    return await run(_db.deduct_balance, tg_id, amount, kind, ref, note)
+
+def cache_stats() -> dict:
+    return _db.cache_stats()
+
+async def user_ids_page(after: int = None, limit: int = 500) -> list:
+    return await run(_db.user_ids_page, after, limit)
+
+async def count_users() -> int:
+    return await run(_db.count_users)
+
+async def user_stats(day: str = None) -> dict:
+    return await run(_db.user_stats, day)
+
+async def finance_report(day: str = None) -> dict:
+    return await run(_db.finance_report, day)
+
+async def rebuild_finance(fix: bool = False) -> dict:
+    return await run(_db.rebuild_finance, fix)
+
+# Deposits / Withdraws
+async def create_deposit(data: dict) -> dict:
+    return await run(_db.create_deposit, data)
+
+async def get_deposit(req_id: str):
+    return await run(_db.get_deposit, req_id)
+
+async def update_deposit(req_id: str, data: dict):
+    return await run(_db.update_deposit, req_id, data)
+
+async def create_withdraw(data: dict) -> str:
+    return await run(_db.create_withdraw, data)
+
+async def get_withdraw(req_id: str):
+    return await run(_db.get_withdraw, req_id)
+
+async def update_withdraw(req_id: str, data: dict):
+    return await run(_db.update_withdraw, req_id, data)
+
+async def map_group_post(chat_id: int, message_ids: list, kind: str, req_id: str):
+    return await run(_db.map_group_post, chat_id, message_ids, kind, req_id)
+
+async def get_group_post(chat_id: int, message_id: int):
+    # cache hits don't need the thread pool
+    hit, post = _db.cached_group_post(chat_id, message_id)
+    if hit:
+        return post
+    return await run(_db.get_group_post, chat_id, message_id)
+
+async def pending_page(kind: str, cursor: str = None, direction: str = "next", limit: int = 8):
+    return await run(_db.pending_page, kind, cursor, direction, limit)
+
+async def decide_requests(kind: str, req_ids: list, approve: bool, notify=None) -> list:
+    return await run(_db.decide_requests, kind, req_ids, approve, notify)
+
+async def ledger_page(tg_id: int, cursor: str = None, direction: str = "next", limit: int = 5):
+    return await run(_db.ledger_page, tg_id, cursor, direction, limit)
+
+async def reconcile_balance(tg_id: int) -> dict:
+    return await run(_db.reconcile_balance, tg_id)
+
+# Outbox
+async def outbox_claim(limit: int, lease_sec: float) -> list:
+    return await run(_db.outbox_claim, limit, lease_sec)
+
+async def outbox_done(msg_id: str, status: str = "sent", error: str = None):
+    return await run(_db.outbox_done, msg_id, status, error)
+
+async def outbox_retry(msg_id: str, delay: float, error: str = None):
+    return await run(_db.outbox_retry, msg_id, delay, error)
+
+async def outbox_prune(limit: int = 400) -> int:
+    return await run(_db.outbox_prune, limit)
+
+async def outbox_backlog() -> int:
+    return await run(_db.outbox_backlog)
+
+# Broadcast jobs
+async def create_broadcast(data: dict) -> str:
+    return await run(_db.create_broadcast, data)
+
+async def update_broadcast(job_id: str, data: dict):
+    return await run(_db.update_broadcast, job_id, data)
+
+async def running_broadcasts() -> list:
+    return await run(_db.running_broadcasts)
+
+# Products
+async def create_product(name: str, price: float, stock: int, delivery: str, shards: int = _db.STOCK_SHARDS, pool: bool = False, category: str = "") -> str:
+    return await run(_db.create_product, name, price, stock, delivery, shards, pool, category)
+
+async def sharded_stock(pid: str) -> int:
+    return await run(_db.sharded_stock, pid)
+
+async def add_codes(pid: str, items: list) -> dict:
+    return await run(_db.add_codes, pid, items)
+
+async def pool_stock(pid: str) -> int:
+    return await run(_db.pool_stock, pid)
+
+async def reshard_product(pid: str, shards: int):
+    return await run(_db.reshard_product, pid, shards)
+
+async def list_products():
+    return await run(_db.list_products)
+
+async def purchase(tg_id: int, pid: str, notify=None) -> dict:
+    return await run(_db.purchase, tg_id, pid, notify)
+
+async def get_product(pid: str):
+    return await run(_db.get_product, pid)
+
+async def update_product(pid: str, data: dict):
+    return await run(_db.update_product, pid, data)
+
+async def delete_product(pid: str):
+    return await run(_db.delete_product, pid)
@@ -0,0 +1,124 @@
+# Webhook runner (RUN_MODE=webhook).
+#
+# WEBHOOK_WORKERS=1: one process serves the webhook with aiogram's aiohttp
+# integration. WEBHOOK_WORKERS=N: this process only listens and forwards
+# each update to worker (user_id % N), each worker a full bot process on
+# 127.0.0.1:WEBHOOK_WORKER_PORT+i. A user always lands on the same worker,
+# so their FSM state stays in one place.
+import json
+import multiprocessing
+import os
+
+from aiohttp import ClientSession, ClientError, web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from .config import (
+    STORAGE_BACKEND, METRICS_PORT,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_LISTEN_HOST, WEBHOOK_LISTEN_PORT, WEBHOOK_WORKERS, WEBHOOK_WORKER_PORT,
+)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def update_user_id(update: dict) -> int:
+    # the user behind an update (falls back to the chat, then 0)
+    for key, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user and "id" in user:
+            return int(user["id"])
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return int(chat["id"])
+    return 0
+
+async def _set_webhook(bot: Bot, dispatcher: Dispatcher):
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+
+def _serve(dp: Dispatcher, bot: Bot, host: str, port: int, secret: str = None, set_webhook: bool = False):
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=WEBHOOK_PATH)
+    if set_webhook:
+        dp.startup.register(_set_webhook)
+    setup_application(app, dp, bot=bot)
+    web.run_app(app, host=host, port=port, print=None)
+
+def _worker(index: int):
+    # child process: a full bot serving forwarded updates on localhost
+    from .main import dp, create_bot
+    _serve(dp, create_bot(), "127.0.0.1", WEBHOOK_WORKER_PORT + index)
+
+def run_webhook(dp: Dispatcher, bot: Bot):
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL missing. Put it in .env")
+    if WEBHOOK_WORKERS <= 1:
+        return _serve(dp, bot, WEBHOOK_LISTEN_HOST, WEBHOOK_LISTEN_PORT, WEBHOOK_SECRET or None, set_webhook=True)
+    if STORAGE_BACKEND == "memory":
+        raise RuntimeError("STORAGE_BACKEND=memory can't be shared by several workers")
+    _run_router(bot, dp)
+
+def _start_workers() -> list:
+    ctx = multiprocessing.get_context("spawn")
+    procs = []
+    saved = {k: os.environ.get(k) for k in ("WORKER_INDEX", "METRICS_PORT")}
+    try:
+        for i in range(WEBHOOK_WORKERS):
+            # children read these at import: own index, own metrics port
+            os.environ["WORKER_INDEX"] = str(i)
+            os.environ["METRICS_PORT"] = str(METRICS_PORT + i) if METRICS_PORT else "0"
+            p = ctx.Process(target=_worker, args=(i,), name=f"bot-worker-{i}", daemon=True)
+            p.start()
+            procs.append(p)
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+    return procs
+
+def _run_router(bot: Bot, dp: Dispatcher):
+    procs = _start_workers()
+    app = web.Application()
+
+    async def forward(request: web.Request):
+        if WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        body = await request.read()
+        try:
+            uid = update_user_id(json.loads(body))
+        except ValueError:
+            return web.Response(status=400)
+        port = WEBHOOK_WORKER_PORT + uid % WEBHOOK_WORKERS
+        try:
+            async with app["http"].post(
+                f"http://127.0.0.1:{port}{WEBHOOK_PATH}", data=body,
+                headers={"Content-Type": "application/json"},
+            ) as resp:
+                return web.Response(status=resp.status)
+        except ClientError:
+            # worker down/restarting: Telegram will redeliver
+            return web.Response(status=502)
+
+    async def on_startup(app):
+        app["http"] = ClientSession()
+        await _set_webhook(bot, dp)
+
+    async def on_cleanup(app):
+        await app["http"].close()
+        await bot.session.close()
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join(timeout=10)
+
+    app.router.add_post(WEBHOOK_PATH, forward)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    web.run_app(app, host=WEBHOOK_LISTEN_HOST, port=WEBHOOK_LISTEN_PORT, print=None)